@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+if TYPE_CHECKING:
+    from .moysklad import MoySkladClient
+
+# поля строки ассортимента, которых хватает для поиска по артикулу и разворачивания
+INDEX_FIELDS = ("id", "article", "code", "updated")
+
+
+class AssortmentIndex:
+    """
+    Локальный снимок /entity/assortment (FBO_CACHE_DIR/assortment.json).
+
+    refresh() докачивает только строки с updated >= водяной знак прошлого прогона;
+    полная перезагрузка — раз в full_refresh_s (чтобы подчистить удалённые позиции).
+    Поиск по article, затем по code — как в find_assortment_by_article.
+    Если артикула в снимке нет — вызывающий идёт в живой поиск МС.
+    """
+
+    def __init__(self, path: str, full_refresh_s: int = 24 * 3600) -> None:
+        self.path = path
+        self.full_refresh_s = full_refresh_s
+        self.rows: Dict[str, Dict[str, Any]] = {}
+        self.watermark: Optional[str] = None
+        self.full_at = 0
+        self._by_article: Dict[str, str] = {}
+        self._by_code: Dict[str, str] = {}
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        if not isinstance(data, dict):
+            return
+        self.rows = data.get("rows") or {}
+        self.watermark = data.get("watermark")
+        self.full_at = int(data.get("full_at") or 0)
+        self._reindex()
+
+    def _reindex(self) -> None:
+        self._by_article = {}
+        self._by_code = {}
+        for rid, r in self.rows.items():
+            if r.get("article"):
+                self._by_article.setdefault(str(r["article"]), rid)
+            if r.get("code"):
+                self._by_code.setdefault(str(r["code"]), rid)
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"watermark": self.watermark, "full_at": self.full_at, "rows": self.rows}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def refresh(self, ms: "MoySkladClient") -> int:
+        """Возвращает количество скачанных строк."""
+        full = not self.watermark or (time.time() - self.full_at) > self.full_refresh_s
+        params: Dict[str, Any] = {}
+        if not full:
+            # updated в МС — время сервера; водяной знак берём из самих строк
+            params["filter"] = f"updated>={self.watermark}"
+
+        rows: Dict[str, Dict[str, Any]] = {} if full else self.rows
+        watermark = None if full else self.watermark
+        n = 0
+        for r in ms.iter_rows("/entity/assortment", params=params, fields=INDEX_FIELDS):
+            rid = r.get("id")
+            if not rid:
+                continue
+            rows[rid] = r
+            n += 1
+            upd = r.get("updated")
+            if upd and (watermark is None or upd > watermark):
+                watermark = upd
+
+        self.rows = rows
+        self.watermark = watermark
+        if full:
+            self.full_at = int(time.time())
+        self._reindex()
+        self.save()
+        print({"action": "assortment_index_refreshed", "full": full, "downloaded": n, "total": len(self.rows)})
+        return n
+
+    def find(self, article: str) -> Optional[Dict[str, Any]]:
+        rid = self._by_article.get(article) or self._by_code.get(article)
+        return self.rows.get(rid) if rid else None
@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# Всё тяжёлое (requests, клиенты, скрипт синка) импортируется внутри команд:
+# status / cache clear / --help не ходят в сеть и не требуют секретов в env.
+
+
+def _script() -> Any:
+    from scripts import sync_fbo_supplies
+
+    return sync_fbo_supplies
+
+
+def _read_json(path: str) -> Optional[Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+# -------- локальные команды (без сети) --------
+
+
+def cmd_status(args: argparse.Namespace) -> int:
+    from .assortment_index import AssortmentIndex
+    from .config import load_storage_paths
+    from .http_cache import ConditionalCache
+    from .state_store import load_checkpoint
+    from .write_journal import WriteJournal
+
+    paths = load_storage_paths()
+
+    ckpt = load_checkpoint(paths.state_file, read_only=True)
+    run = ckpt.data.get("run") or {}
+    state = {
+        "file": paths.state_file,
+        "exists": os.path.exists(paths.state_file),
+        "run_in_progress": ckpt.resumed,
+        "run_started_at": run.get("started_at"),
+        "last_finished_at": ckpt.data.get("last_finished_at"),
+        "retry": {cab: len(q) for cab, q in (ckpt.data.get("retry") or {}).items()},
+        "seen_file": ckpt.seen_path,
+        "seen": {cab: len(v) for cab, v in ckpt.seen.items()},
+    }
+
+    index = AssortmentIndex(paths.assortment_file)
+    plan = _read_json(paths.plan_file)
+
+    print({
+        "action": "status",
+        "state": state,
+        "journal": {"file": paths.journal_file, **WriteJournal(paths.journal_file).stats()},
+        "http_cache": {"dir": paths.http_cache_dir, **ConditionalCache(paths.http_cache_dir).stats()},
+        "assortment_index": {"file": paths.assortment_file, "rows": len(index.rows), "watermark": index.watermark, "full_at": index.full_at or None},
+        "plan": {
+            "file": paths.plan_file,
+            "created_at": plan.get("created_at"),
+            "summary": plan.get("summary"),
+        } if isinstance(plan, dict) else {"file": paths.plan_file, "exists": False},
+    })
+    return 0
+
+
+def cmd_cache_clear(args: argparse.Namespace) -> int:
+    from .config import load_storage_paths
+    from .http_cache import ConditionalCache
+
+    paths = load_storage_paths()
+    cache = ConditionalCache(paths.http_cache_dir)
+    before = cache.stats()
+    cache.clear()
+    removed_index = False
+    if not args.keep_index and os.path.exists(paths.assortment_file):
+        os.remove(paths.assortment_file)
+        removed_index = True
+    print({"action": "cache_cleared", "http_cache": before, "assortment_index_removed": removed_index})
+    return 0
+
+
+# -------- сетевые команды --------
+
+
+def cmd_sync(args: argparse.Namespace) -> int:
+    _script().sync()
+    return 0
+
+
+def cmd_daemon(args: argparse.Namespace) -> int:
+    _script().daemon()
+    return 0
+
+
+def cmd_plan(args: argparse.Namespace) -> int:
+    _script().plan(args.out)
+    return 0
+
+
+def cmd_apply_plan(args: argparse.Namespace) -> int:
+    stats = _script().apply_plan_file(args.path)
+    return 1 if any(k.endswith("_failed") for k in stats) else 0
+
+
+def cmd_dedup(args: argparse.Namespace) -> int:
+    """Дубли документов синка по externalCode: по умолчанию только отчёт/план, --apply — удаление."""
+    s = _script()
+    from .config import load_config
+    from .fbo_plan import MsSnapshot, apply_plan, dedup_plan
+
+    cfg = load_config()
+    ms = s._ms_client(cfg)
+    sync_plan = dedup_plan(MsSnapshot.load(ms))
+    if args.out:
+        sync_plan.save(args.out)
+    if args.apply and sync_plan.ops:
+        stats = apply_plan(ms, sync_plan)
+        print({"action": "dedup_done", **stats})
+        return 1 if any(k.endswith("_failed") for k in stats) else 0
+    print({"action": "dedup_planned", "ops": len(sync_plan.ops), **sync_plan.summary()})
+    return 0
+
+
+def cmd_reconcile(args: argparse.Namespace) -> int:
+    report = _script().reconcile(args.out)
+    return 1 if report.issues else 0
+
+
+def cmd_cache_warm(args: argparse.Namespace) -> int:
+    """Снимок ассортимента (delta) + компоненты комплектов в условный HTTP-кэш."""
+    s = _script()
+    from .config import load_config
+
+    cfg = load_config()
+    ms = s._ms_client(cfg)
+    if ms.assortment_index is None:
+        print({"action": "cache_warm_skipped", "reason": "FBO_ASSORTMENT_INDEX is off"})
+        return 0
+    s._refresh_assortment_index(ms)
+    bundles = 0
+    for row in list(ms.assortment_index.rows.values()):
+        if (row.get("meta") or {}).get("type") == "bundle" and row.get("id"):
+            ms.get_bundle_component_positions(row["id"])
+            bundles += 1
+    print({"action": "cache_warmed", "assortment_rows": len(ms.assortment_index.rows), "bundles": bundles, **ms.http_cache.stats()})
+    return 0
+
+
+def cmd_bench(args: argparse.Namespace) -> int:
+    """Время пакетных чтений, на которых стоят sync/plan (без записей)."""
+    s = _script()
+    from .config import load_config
+    from .fbo_plan import MsSnapshot
+    from .stock_planner import StockPlanner
+
+    cfg = load_config()
+    ms = s._ms_client(cfg)
+    out: Dict[str, Any] = {}
+
+    def _timed(name: str, fn: Callable[[], int]) -> None:
+        t0 = time.perf_counter()
+        try:
+            n = fn()
+        except Exception as e:
+            out[name] = {"error": str(e)[:300]}
+            return
+        out[name] = {"s": round(time.perf_counter() - t0, 3), "rows": n}
+
+    for cab, oz in s._cabinets(cfg):
+        ids: List[int] = []
+
+        def _list() -> int:
+            for state in s.SYNC_STATES:
+                for _, page in oz.iter_supply_order_pages(state=state, limit=100):
+                    ids.extend(page)
+            return len(ids)
+
+        _timed(f"ozon_list:{cab.name}", _list)
+        _timed(f"ozon_details:{cab.name}", lambda: len(oz.fetch_supply_orders(ids[:s.DETAILS_BATCH])) if ids else 0)
+
+    _timed("ms_snapshot", lambda: sum(len(v) for d in MsSnapshot.load(ms).docs.values() for v in d.values()))
+    if ms.assortment_index is not None:
+        _timed("ms_assortment_index", lambda: ms.assortment_index.refresh(ms))
+
+    def _stock() -> int:
+        planner = StockPlanner(ms, s.MOVE_SOURCE_STORE_ID)
+        planner.load()
+        return len(planner.available or {})
+
+    _timed("ms_stock_bystore", _stock)
+    print({"action": "bench", **out})
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(prog="python -m app", description="Ozon FBO -> MoySklad sync")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("sync", help="one-shot sync (FBO_DRY_RUN -> plan)").set_defaults(func=cmd_sync)
+    sub.add_parser("daemon", help="long-running sync with per-state polling").set_defaults(func=cmd_daemon)
+
+    sp = sub.add_parser("plan", help="build the write plan without MoySklad writes")
+    sp.add_argument("--out", help="plan file (default FBO_PLAN_FILE)")
+    sp.set_defaults(func=cmd_plan)
+
+    sp = sub.add_parser("apply-plan", help="execute a saved plan in batches")
+    sp.add_argument("path", nargs="?", help="plan file (default FBO_PLAN_FILE)")
+    sp.set_defaults(func=cmd_apply_plan)
+
+    sp = sub.add_parser("dedup", help="find duplicate sync documents by externalCode")
+    sp.add_argument("--apply", action="store_true", help="delete duplicates (default: report only)")
+    sp.add_argument("--out", help="also save the delete plan to this file")
+    sp.set_defaults(func=cmd_dedup)
+
+    sp = sub.add_parser("reconcile", help="compare Ozon supplies with MoySklad documents (read-only; exit 1 on issues)")
+    sp.add_argument("--out", help="save the report as JSON")
+    sp.set_defaults(func=cmd_reconcile)
+
+    sub.add_parser("bench", help="time the bulk reads sync/plan depend on").set_defaults(func=cmd_bench)
+    sub.add_parser("status", help="local cache / state / journal status (no network)").set_defaults(func=cmd_status)
+
+    sp = sub.add_parser("cache", help="local caches")
+    cache_sub = sp.add_subparsers(dest="cache_command", required=True)
+    cache_sub.add_parser("warm", help="refresh assortment index and bundle components").set_defaults(func=cmd_cache_warm)
+    cp = cache_sub.add_parser("clear", help="drop the HTTP cache and assortment index (no network)")
+    cp.add_argument("--keep-index", action="store_true", help="keep the assortment index")
+    cp.set_defaults(func=cmd_cache_clear)
+
+    return p
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return int(args.func(args) or 0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,18 @@
 from __future__ import annotations
 
+import json
 import os
+import re
 from dataclasses import dataclass
 from datetime import date
+from typing import Any
 
-from dotenv import load_dotenv
+
+def _load_env() -> None:
+    # dotenv импортируется лениво: status/cache-команды CLI не должны платить за лишнее
+    from dotenv import load_dotenv
+
+    load_dotenv()
 
 
 def _env(name: str, default: str | None = None) -> str:
@@ -28,6 +36,116 @@ class OzonCabinet:
     api_key: str
     ms_saleschannel_id: str
 
+    # МС-реквизиты кабинета; None — общие значения из скрипта синка
+    ms_store_id: str | None = None
+    ms_order_state_id: str | None = None
+    ms_move_state_id: str | None = None
+    ms_demand_state_id: str | None = None
+    ms_move_source_store_id: str | None = None
+
+    # сколько поставок кабинета обрабатывается параллельно
+    concurrency: int = 1
+
+
+_CABINET_ENV_RE = re.compile(r"^OZON(\d+)_CLIENT_ID$")
+
+# необязательные поля кабинета: поле -> env-префикс (к нему добавляется _CAB<N>)
+_CABINET_OPTIONAL_ENV = {
+    "ms_store_id": "MS_STORE_ID",
+    "ms_order_state_id": "MS_ORDER_STATE_ID",
+    "ms_move_state_id": "MS_MOVE_STATE_ID",
+    "ms_demand_state_id": "MS_DEMAND_STATE_ID",
+    "ms_move_source_store_id": "MS_MOVE_SOURCE_STORE_ID",
+}
+
+
+def _cabinet_from_dict(d: dict[str, Any]) -> OzonCabinet:
+    """
+    Кабинет из FBO_CABINETS_FILE. Секреты можно не класть в файл:
+    client_id_env / api_key_env — имена env-переменных со значениями.
+    """
+    def _field(name: str, required: bool = True) -> str | None:
+        if d.get(f"{name}_env"):
+            return _env(str(d[f"{name}_env"]))
+        v = d.get(name)
+        if (v is None or v == "") and required:
+            raise ValueError(f"Cabinet {d.get('name')!r}: missing {name}")
+        return str(v) if v not in (None, "") else None
+
+    return OzonCabinet(
+        name=str(d.get("name") or ""),
+        client_id=_field("client_id") or "",
+        api_key=_field("api_key") or "",
+        ms_saleschannel_id=_field("ms_saleschannel_id") or "",
+        concurrency=max(int(d.get("concurrency") or 1), 1),
+        **{k: _field(k, required=False) for k in _CABINET_OPTIONAL_ENV},
+    )
+
+
+def load_cabinets() -> list[OzonCabinet]:
+    """
+    Реестр кабинетов:
+    - FBO_CABINETS_FILE — JSON-список кабинетов (см. _cabinet_from_dict);
+    - иначе скан env: каждый OZON<N>_CLIENT_ID даёт кабинет cab<N>
+      (OZON<N>_API_KEY, MS_SALESCHANNEL_ID_CAB<N>, необязательные
+      MS_STORE_ID_CAB<N>, MS_*_STATE_ID_CAB<N>, MS_MOVE_SOURCE_STORE_ID_CAB<N>,
+      FBO_CONCURRENCY_CAB<N>).
+    """
+    path = os.getenv("FBO_CABINETS_FILE", "").strip()
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        if not isinstance(raw, list):
+            raise ValueError(f"{path}: expected a JSON list of cabinets")
+        cabinets = [_cabinet_from_dict(d) for d in raw]
+    else:
+        nums = sorted(int(m.group(1)) for m in map(_CABINET_ENV_RE.match, os.environ) if m)
+        cabinets = [
+            OzonCabinet(
+                name=f"cab{n}",
+                client_id=_env(f"OZON{n}_CLIENT_ID"),
+                api_key=_env(f"OZON{n}_API_KEY"),
+                ms_saleschannel_id=_env(f"MS_SALESCHANNEL_ID_CAB{n}"),
+                concurrency=max(int(os.getenv(f"FBO_CONCURRENCY_CAB{n}", "1") or 1), 1),
+                **{k: (os.getenv(f"{prefix}_CAB{n}", "").strip() or None) for k, prefix in _CABINET_OPTIONAL_ENV.items()},
+            )
+            for n in nums
+        ]
+
+    if not cabinets:
+        raise ValueError("No Ozon cabinets configured (FBO_CABINETS_FILE or OZON<N>_CLIENT_ID)")
+    names = [c.name for c in cabinets]
+    if len(set(names)) != len(names) or not all(names):
+        raise ValueError(f"Cabinet names must be unique and non-empty: {names}")
+    return cabinets
+
+
+@dataclass(frozen=True)
+class StoragePaths:
+    """Локальные файлы синка — доступны без секретов и сети (status / cache clear)."""
+    state_file: str
+    cache_dir: str
+    plan_file: str
+    journal_file: str
+
+    @property
+    def http_cache_dir(self) -> str:
+        return os.path.join(self.cache_dir, "http")
+
+    @property
+    def assortment_file(self) -> str:
+        return os.path.join(self.cache_dir, "assortment.json")
+
+
+def load_storage_paths() -> StoragePaths:
+    _load_env()
+    return StoragePaths(
+        state_file=os.getenv("FBO_STATE_FILE", "").strip() or ".fbo_state.json",
+        cache_dir=os.getenv("FBO_CACHE_DIR", "").strip() or ".fbo_cache",
+        plan_file=os.getenv("FBO_PLAN_FILE", "").strip() or ".fbo_plan.json",
+        journal_file=os.getenv("FBO_JOURNAL_FILE", "").strip() or ".fbo_journal.json",
+    )
+
 
 @dataclass(frozen=True)
 class Config:
@@ -42,27 +160,32 @@ class Config:
     fbo_dry_run: bool
     fbo_exclude_order_ids: set[int]
 
+    fbo_state_file: str
+    fbo_retry_max_attempts: int
+    fbo_cache_ttl_s: int
+    fbo_stock_preflight: bool
+    fbo_cache_dir: str
+    fbo_assortment_index: bool
+    fbo_plan_file: str
+    fbo_journal_file: str
+
+    # предохранители HTTP: сбоев подряд до размыкания, пауза, бюджет повторов
+    fbo_breaker_failures: int
+    fbo_breaker_cooldown_s: float
+    fbo_retry_budget: float
+
+    # общий бюджет запросов в МС на все кабинеты
+    ms_rate_per_s: float
+    ms_rate_burst: int
+
 def load_config() -> Config:
-    load_dotenv()
+    paths = load_storage_paths()
 
     planned_from_raw = os.getenv("FBO_PLANNED_FROM")
     planned_from = date.fromisoformat(planned_from_raw) if planned_from_raw else None
 
-    cabinets = [
-        OzonCabinet(
-            name="cab1",
-            client_id=_env("OZON1_CLIENT_ID"),
-            api_key=_env("OZON1_API_KEY"),
-            ms_saleschannel_id=_env("MS_SALESCHANNEL_ID_CAB1"),
-        ),
-        OzonCabinet(
-            name="cab2",
-            client_id=_env("OZON2_CLIENT_ID"),
-            api_key=_env("OZON2_API_KEY"),
-            ms_saleschannel_id=_env("MS_SALESCHANNEL_ID_CAB2"),
-        ),
-    ]
-    
+    cabinets = load_cabinets()
+
     raw_exclude = os.getenv("FBO_EXCLUDE_ORDER_IDS", "").strip()
     fbo_exclude_order_ids: set[int] = set()
 
@@ -82,4 +205,17 @@ def load_config() -> Config:
         fbo_planned_from=planned_from,
         fbo_dry_run=_env_bool("FBO_DRY_RUN", default=True),
         fbo_exclude_order_ids=fbo_exclude_order_ids,
+        fbo_state_file=paths.state_file,
+        fbo_retry_max_attempts=int(os.getenv("FBO_RETRY_MAX_ATTEMPTS", "5") or 5),
+        fbo_cache_ttl_s=int(os.getenv("FBO_CACHE_TTL_S", "600") or 600),
+        fbo_stock_preflight=_env_bool("FBO_STOCK_PREFLIGHT", default=True),
+        fbo_cache_dir=paths.cache_dir,
+        fbo_assortment_index=_env_bool("FBO_ASSORTMENT_INDEX", default=True),
+        fbo_plan_file=paths.plan_file,
+        fbo_journal_file=paths.journal_file,
+        fbo_breaker_failures=int(os.getenv("FBO_BREAKER_FAILURES", "5") or 5),
+        fbo_breaker_cooldown_s=float(os.getenv("FBO_BREAKER_COOLDOWN_S", "60") or 60),
+        fbo_retry_budget=float(os.getenv("FBO_RETRY_BUDGET", "50") or 50),
+        ms_rate_per_s=float(os.getenv("FBO_MS_RATE_PER_S", "10") or 10),
+        ms_rate_burst=int(os.getenv("FBO_MS_RATE_BURST", "5") or 5),
     )
@@ -0,0 +1,374 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .moysklad import MoySkladClient, MsWriteResult
+from .ms_apply import _item_errors, create_applied_batch
+from .ms_move import try_apply_move, update_move_positions_applied, update_move_positions_only
+from .stock_planner import assortment_id_from_href
+
+PLAN_VERSION = 1
+
+# все три externalCode синка (OZON_FBO:, OZON_FBO_MOVE:, OZON_FBO_DEMAND:) начинаются с него
+FBO_EXT_PREFIX = "OZON_FBO"
+PLAN_ENTITIES = ("customerorder", "move", "demand")
+
+# поля документа в снимке: dedup, связи и всё, что сравнивается в diff
+SNAPSHOT_FIELDS = (
+    "id", "name", "externalCode", "updated", "applicable", "description", "deliveryPlannedMoment",
+    "organization", "agent", "state", "salesChannel", "store", "sourceStore", "targetStore",
+    "customerOrder", "positions",
+)
+
+# ссылка на заказ, который создаётся этим же планом: {"$order": "<externalCode заказа>"}
+ORDER_LINK_KEY = "$order"
+
+# документов в одном POST-массиве при применении плана
+APPLY_BATCH = 100
+
+
+def _href(v: Any) -> Optional[str]:
+    return ((v or {}).get("meta") or {}).get("href") if isinstance(v, dict) else None
+
+
+def positions_map(v: Any) -> Optional[Dict[str, List[float]]]:
+    """
+    Позиции -> {assortment_id: [quantity, price]}.
+    v — список позиций payload или expand=positions из МС ({"meta", "rows"}).
+    None — если МС отдал позиции не полностью (сравнивать не с чем).
+    """
+    if isinstance(v, dict):
+        rows = v.get("rows")
+        if rows is None or int((v.get("meta") or {}).get("size") or 0) > len(rows):
+            return None
+    else:
+        rows = v or []
+    out: Dict[str, List[float]] = {}
+    for p in rows:
+        href = _href(p.get("assortment"))
+        if not href:
+            continue
+        cur = out.setdefault(assortment_id_from_href(href), [0.0, float(p.get("price") or 0)])
+        cur[0] += float(p.get("quantity") or 0)
+    return out
+
+
+def diff_doc(existing: Dict[str, Any], payload: Dict[str, Any], fields: Sequence[str]) -> Dict[str, Any]:
+    """
+    Пополевой diff существующего документа МС и нового payload: поле -> [было, станет].
+    Ссылки сравниваются по href, позиции — по товару: positions -> {id: [[qty, price], [qty, price]]}.
+    """
+    out: Dict[str, Any] = {}
+    for k in fields:
+        if k not in payload:
+            continue
+        new, old = payload[k], existing.get(k)
+        if k == "positions":
+            old_p, new_p = positions_map(old), positions_map(new) or {}
+            if old_p is None:
+                out[k] = {aid: [None, v] for aid, v in new_p.items()}
+                continue
+            changed = {
+                aid: [old_p.get(aid), new_p.get(aid)]
+                for aid in sorted(set(old_p) | set(new_p))
+                if old_p.get(aid) != new_p.get(aid)
+            }
+            if changed:
+                out[k] = changed
+        elif isinstance(new, dict) and "meta" in new:
+            if _href(old) != _href(new):
+                out[k] = [_href(old), _href(new)]
+        elif old != new:
+            out[k] = [old, new]
+    return out
+
+
+class MsSnapshot:
+    """
+    Все документы синка из МС: один постраничный проход на сущность
+    (filter=externalCode~=OZON_FBO, expand=positions) вместо поиска
+    по externalCode на каждую поставку.
+    """
+
+    def __init__(self) -> None:
+        self.docs: Dict[str, Dict[str, List[Dict[str, Any]]]] = {e: {} for e in PLAN_ENTITIES}
+
+    @classmethod
+    def load(cls, ms: MoySkladClient, entities: Sequence[str] = PLAN_ENTITIES) -> "MsSnapshot":
+        snap = cls()
+        for entity in entities:
+            by_ext = snap.docs.setdefault(entity, {})
+            rows = ms.iter_rows(
+                f"/entity/{entity}",
+                params={"filter": f"externalCode~={FBO_EXT_PREFIX}", "expand": "positions"},
+                fields=SNAPSHOT_FIELDS,
+                # МС отдаёт expand только при limit <= 100
+                page_limit=100,
+            )
+            for r in rows:
+                ext = r.get("externalCode")
+                if ext:
+                    by_ext.setdefault(ext, []).append(r)
+        print({"action": "ms_snapshot_loaded", **{e: sum(len(v) for v in d.values()) for e, d in snap.docs.items()}})
+        return snap
+
+    def pick(self, entity: str, external_code: str) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """(оставляемый документ — последний по updated, дубли на удаление)"""
+        rows = sorted(self.docs.get(entity, {}).get(external_code) or [], key=lambda r: r.get("updated") or "")
+        if not rows:
+            return None, []
+        return rows[-1], rows[:-1]
+
+
+@dataclass
+class PlanOp:
+    """
+    Одна запись плана.
+    op: create / update / delete / apply.
+    apply: для move — проводить ли (решение планировщика остатков), None — пробовать.
+    diff: пополевой diff для update (см. diff_doc).
+    """
+    op: str
+    entity: str
+    external_code: str
+    cabinet: str = ""
+    order_id: Optional[int] = None
+    id: Optional[str] = None
+    payload: Dict[str, Any] = field(default_factory=dict)
+    diff: Dict[str, Any] = field(default_factory=dict)
+    apply: Optional[bool] = None
+
+    def as_log(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"action": f"plan_{self.entity}_{self.op}", "externalCode": self.external_code}
+        if self.id:
+            out["id"] = self.id
+        if self.diff:
+            out["diff"] = self.diff
+        if self.apply is not None:
+            out["apply"] = self.apply
+        return out
+
+
+@dataclass
+class SyncPlan:
+    """План записей в МС (FBO_PLAN_FILE): строится без записей, исполняется apply_plan()."""
+
+    created_at: int = field(default_factory=lambda: int(time.time()))
+    ops: List[PlanOp] = field(default_factory=list)
+
+    def add(self, op: PlanOp) -> None:
+        self.ops.append(op)
+        print(op.as_log())
+
+    def summary(self) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        for op in self.ops:
+            k = f"{op.entity}_{op.op}"
+            out[k] = out.get(k, 0) + 1
+        return out
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {"version": PLAN_VERSION, "created_at": self.created_at, "summary": self.summary(), "ops": [asdict(op) for op in self.ops]},
+                f, ensure_ascii=False, indent=1,
+            )
+        os.replace(tmp, path)
+
+
+def dedup_plan(snapshot: MsSnapshot) -> SyncPlan:
+    """План только из удалений дублей по externalCode (оставляется последний по updated)."""
+    sync_plan = SyncPlan()
+    for entity, by_ext in snapshot.docs.items():
+        for ext in sorted(by_ext):
+            _, dups = snapshot.pick(entity, ext)
+            for d in dups:
+                sync_plan.add(PlanOp(op="delete", entity=entity, external_code=ext, id=d.get("id")))
+    return sync_plan
+
+
+def load_plan(path: str) -> SyncPlan:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict) or data.get("version") != PLAN_VERSION:
+        raise ValueError(f"{path}: unsupported plan version {data.get('version') if isinstance(data, dict) else None!r}")
+    return SyncPlan(created_at=int(data.get("created_at") or 0), ops=[PlanOp(**op) for op in data.get("ops") or []])
+
+
+# ----------------------------
+# apply
+# ----------------------------
+
+
+def _chunks(items: List[Any], n: int) -> List[List[Any]]:
+    return [items[i:i + n] for i in range(0, len(items), n)]
+
+
+def _resolve_order_link(payload: Dict[str, Any], orders: Dict[str, Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Подставляет ссылку на заказ, созданный этим планом; None — заказ не создался."""
+    link = payload.get("customerOrder")
+    if not isinstance(link, dict) or ORDER_LINK_KEY not in link:
+        return payload
+    ref = orders.get(link[ORDER_LINK_KEY])
+    return dict(payload, customerOrder=ref) if ref else None
+
+
+def _existing_refs(ms: MoySkladClient, entities: Sequence[str]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    entity -> {externalCode: {"meta": ...}} документов синка, уже существующих в МС.
+    Один постраничный проход на сущность, без expand — только externalCode и meta.
+    """
+    out: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for entity in entities:
+        by_ext = out.setdefault(entity, {})
+        rows = ms.iter_rows(f"/entity/{entity}", params={"filter": f"externalCode~={FBO_EXT_PREFIX}"}, fields=("externalCode",))
+        for r in rows:
+            ext = r.get("externalCode")
+            if ext and r.get("meta"):
+                by_ext[ext] = {"meta": r["meta"]}
+    return out
+
+
+def _post_batch(ms: MoySkladClient, entity: str, ops: List[PlanOp], payloads: List[Dict[str, Any]], suffix: str = "") -> List[MsWriteResult]:
+    """POST-массив; payload с meta — обновление, без — создание. Порядок результатов = порядок ops."""
+    docs = ms.create(entity, payloads)
+    results: List[MsWriteResult] = []
+    for op, doc in zip(ops, docs if isinstance(docs, list) else []):
+        errs = _item_errors(doc)
+        action = f"{entity}_{op.op}_failed" if errs else f"{entity}_{op.op}d{suffix}"
+        results.append(MsWriteResult.from_doc(action, entity, {"errors": errs} if errs else doc, name=op.payload.get("name"), external_code=op.external_code))
+    return results
+
+
+def apply_plan(ms: MoySkladClient, plan: SyncPlan, batch: int = APPLY_BATCH) -> Dict[str, int]:
+    """
+    Исполняет план пакетами, в порядке зависимостей:
+    1) удаление дублей (массовое удаление МС, POST /entity/<entity>/delete);
+    2) заказы: create + update одним POST-массивом;
+    3) перемещения: create (проведённые — create_applied_batch), update, apply;
+    4) отгрузки: create_applied_batch.
+    План мог устареть (между plan и apply-plan прошёл обычный синк): перед созданиями
+    externalCode сверяются с МС одним проходом на сущность, уже существующие документы
+    не создаются (заказ берётся существующий — для связи move/demand).
+    Move/demand, чей заказ не создался, пропускаются. Ошибка пакета не останавливает
+    остальные пакеты. Возвращает счётчики по action.
+    """
+    stats: Dict[str, int] = {}
+
+    def _count(action: str, n: int = 1) -> None:
+        stats[action] = stats.get(action, 0) + n
+
+    def _log(res: MsWriteResult) -> None:
+        _count(res.action)
+        print(res.as_log())
+
+    def _failed(entity: str, ops: List[PlanOp], e: Exception) -> None:
+        _count(f"{entity}_batch_failed", len(ops))
+        print({"action": "plan_batch_failed", "entity": entity, "externalCodes": [op.external_code for op in ops], "error": str(e)[:300]})
+
+    by_kind: Dict[Tuple[str, str], List[PlanOp]] = {}
+    for op in plan.ops:
+        by_kind.setdefault((op.entity, op.op), []).append(op)
+
+    # создания устаревшего плана не должны плодить дубли
+    orders: Dict[str, Dict[str, Any]] = {}
+    create_entities = [e for e in PLAN_ENTITIES if by_kind.get((e, "create"))]
+    if create_entities:
+        existing = _existing_refs(ms, create_entities)
+        for entity in create_entities:
+            fresh = []
+            for op in by_kind[(entity, "create")]:
+                ref = existing[entity].get(op.external_code)
+                if ref is None:
+                    fresh.append(op)
+                    continue
+                _count(f"{entity}_create_skipped_exists")
+                print({"action": "plan_skip_exists", "entity": entity, "externalCode": op.external_code, "id": ref["meta"].get("href", "").rsplit("/", 1)[-1]})
+                if entity == "customerorder":
+                    orders[op.external_code] = ref
+            by_kind[(entity, "create")] = fresh
+
+    # 1) дубли
+    for entity in PLAN_ENTITIES:
+        for chunk in _chunks(by_kind.get((entity, "delete"), []), batch):
+            try:
+                ms.post(f"/entity/{entity}/delete", [ms.meta(entity, op.id) for op in chunk if op.id])
+                _count(f"{entity}_deleted", len(chunk))
+            except Exception as e:
+                _failed(entity, chunk, e)
+
+    # 2) заказы; их ссылки нужны перемещениям и отгрузкам
+    order_ops = by_kind.get(("customerorder", "create"), []) + by_kind.get(("customerorder", "update"), [])
+    for chunk in _chunks(order_ops, batch):
+        payloads = [dict(op.payload, **ms.meta("customerorder", op.id)) if op.op == "update" else op.payload for op in chunk]
+        try:
+            results = _post_batch(ms, "customerorder", chunk, payloads)
+        except Exception as e:
+            _failed("customerorder", chunk, e)
+            continue
+        for res in results:
+            _log(res)
+            if res.ref():
+                orders[res.external_code or ""] = res.ref()
+
+    def _linked(entity: str, ops: List[PlanOp]) -> List[Tuple[PlanOp, Dict[str, Any]]]:
+        out = []
+        for op in ops:
+            payload = _resolve_order_link(op.payload, orders)
+            if payload is None:
+                _count(f"{entity}_skipped_no_order")
+                print({"action": "plan_skip_no_order", "entity": entity, "externalCode": op.external_code})
+                continue
+            out.append((op, payload))
+        return out
+
+    # 3) перемещения
+    creates = _linked("move", by_kind.get(("move", "create"), []))
+    for applied in (True, False):
+        group = [(op, p) for op, p in creates if (op.apply is not False) == applied]
+        for chunk in _chunks(group, batch):
+            try:
+                if applied:
+                    results = create_applied_batch(ms, "move", [p for _, p in chunk])
+                else:
+                    results = _post_batch(ms, "move", [op for op, _ in chunk], [dict(p, applicable=False) for _, p in chunk], suffix="_unapplied")
+            except Exception as e:
+                _failed("move", [op for op, _ in chunk], e)
+                continue
+            for res in results:
+                _log(res)
+
+    for op in by_kind.get(("move", "update"), []):
+        positions = op.payload.get("positions") or []
+        try:
+            if op.apply is False:
+                res = update_move_positions_only(ms, op.id or "", positions)
+            else:
+                res = update_move_positions_applied(ms, op.id or "", positions)
+        except Exception as e:
+            _failed("move", [op], e)
+            continue
+        _log(res)
+
+    for op in by_kind.get(("move", "apply"), []):
+        out = try_apply_move(ms, op.id or "")
+        _count(out["action"])
+        print(out)
+
+    # 4) отгрузки
+    for chunk in _chunks(_linked("demand", by_kind.get(("demand", "create"), [])), batch):
+        try:
+            results = create_applied_batch(ms, "demand", [p for _, p in chunk])
+        except Exception as e:
+            _failed("demand", [op for op, _ in chunk], e)
+            continue
+        for res in results:
+            _log(res)
+
+    return stats
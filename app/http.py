@@ -1,65 +1,315 @@
 from __future__ import annotations
 
+import codecs
 import json
+import re
+import threading
 import time
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from urllib.parse import urlsplit
 
 import requests
 
+from .http_cache import ConditionalCache
+from .resilience import CircuitBreaker, RetryBudget
+
 
 class HttpError(RuntimeError):
     pass
 
 
-def request_json(
+class RetryableHttpError(HttpError):
+    """
+    Временный сбой (сеть, 429, 5xx), повторы не помогли или бюджет повторов исчерпан.
+    Поставку имеет смысл отложить до следующего прогона, а не считать ошибкой данных.
+    """
+
+
+class CircuitOpenError(RetryableHttpError):
+    """Предохранитель хоста разомкнут — запрос не отправлялся."""
+
+
+class AmbiguousWriteError(RetryableHttpError):
+    """
+    Неидемпотентный запрос (POST создания) ушёл, но ответа нет (таймаут, обрыв, 500/502/504):
+    документ мог создаться. Вслепую не повторяем — вызывающий сначала проверяет по externalCode.
+    """
+
+
+# временные ответы: повторяем с backoff
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+# из них — те, где МС точно не начинал обработку (безопасно повторить и POST создания)
+REJECTED_STATUS = (429, 503)
+
+
+_ROWS_START = re.compile(r'"rows"\s*:\s*\[')
+
+
+_session: Optional[requests.Session] = None
+
+
+def _get_session() -> requests.Session:
+    """
+    Общая сессия на процесс: keep-alive и пул соединений
+    (в daemon-режиме не переоткрываем TLS на каждый запрос).
+    """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+_breaker_failures = 5
+_breaker_cooldown_s = 60.0
+_retry_budget = RetryBudget()
+
+
+def configure_resilience(failure_threshold: int = 5, cooldown_s: float = 60.0, retry_budget: float = 50.0) -> None:
+    """
+    Параметры предохранителей (на хост) и общего бюджета повторов.
+    Вызывается один раз при старте, до первых запросов.
+    """
+    global _breaker_failures, _breaker_cooldown_s, _retry_budget
+    with _breakers_lock:
+        _breaker_failures = failure_threshold
+        _breaker_cooldown_s = cooldown_s
+        _breakers.clear()
+    _retry_budget = RetryBudget(max_tokens=retry_budget)
+
+
+def breaker_for(url: str) -> CircuitBreaker:
+    host = urlsplit(url).netloc
+    with _breakers_lock:
+        b = _breakers.get(host)
+        if b is None:
+            b = _breakers[host] = CircuitBreaker(host, _breaker_failures, _breaker_cooldown_s)
+        return b
+
+
+def resilience_stats() -> Dict[str, Any]:
+    with _breakers_lock:
+        breakers = {host: b.state for host, b in _breakers.items()}
+    return {"breakers": breakers, "retry_budget": _retry_budget.stats()}
+
+
+def _send(
     method: str,
     url: str,
     *,
-    headers: Optional[Dict[str, str]] = None,
-    params: Optional[Dict[str, Any]] = None,
-    json_body: Optional[Dict[str, Any]] = None,
-    timeout: int = 30,
-    retries: int = 8,
-) -> Dict[str, Any]:
+    headers: Optional[Dict[str, str]],
+    params: Optional[Dict[str, Any]],
+    json_body: Optional[Dict[str, Any] | List[Dict[str, Any]]],
+    timeout: int,
+    retries: int,
+    stream: bool = False,
+    data: Optional[bytes] = None,
+    throttle: Optional[Callable[[], None]] = None,
+    idempotent: bool = True,
+) -> requests.Response:
     """
-    Универсальный запрос с ретраями.
-    ВАЖНО: для MoySklad часто ловим 429 — делаем backoff.
+    Запрос с ретраями; возвращает успешный ответ (тело ещё не разобрано).
+    throttle — вызывается перед каждой попыткой (общий бюджет запросов).
+
+    Ошибки:
+    - HttpError — 4xx (кроме 429): повтор не поможет, сразу наружу;
+    - RetryableHttpError — сеть/429/5xx, попытки или общий бюджет повторов кончились;
+    - CircuitOpenError — хост признан лежащим, запрос даже не отправлялся;
+    - AmbiguousWriteError — idempotent=False и исход неизвестен (см. класс): без повтора.
     """
-    last_exc: Optional[BaseException] = None
+    breaker = breaker_for(url)
+    budget = _retry_budget
+    last_err = ""
 
     for attempt in range(1, retries + 1):
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {breaker.name} (retry in {breaker.retry_in_s():.0f}s): {method} {url}")
+        if throttle is not None:
+            throttle()
         try:
-            resp = requests.request(
+            resp = _get_session().request(
                 method=method,
                 url=url,
                 headers=headers,
                 params=params,
                 json=json_body,
+                data=data,
                 timeout=timeout,
+                stream=stream,
             )
         except Exception as e:
-            last_exc = e
-            time.sleep(min(2 ** attempt, 20))
-            continue
-
-        text = resp.text or ""
-
-        # Ретраи на лимит/временные
-        if resp.status_code in (429, 500, 502, 503, 504):
+            last_err = f"{type(e).__name__}: {e}"
+            sleep_s = min(2 ** attempt, 20)
+            if not idempotent and not isinstance(e, requests.exceptions.ConnectTimeout):
+                breaker.record_failure()
+                raise AmbiguousWriteError(f"{method} {url}: no response, outcome unknown: {last_err}") from e
+        else:
+            # Ретраи на лимит/временные
+            if resp.status_code not in RETRYABLE_STATUS:
+                breaker.record_success()
+                budget.deposit()
+                if resp.status_code >= 400:
+                    # 4xx (кроме 429) — ошибка запроса/данных, повтор не поможет
+                    text = resp.text or ""
+                    raise HttpError(f"{resp.status_code} {url} -> {text[:1500]}")
+                return resp
+            last_err = f"{resp.status_code} {url} -> {(resp.text or '')[:500]}"
+            resp.close()
+            if not idempotent and resp.status_code not in REJECTED_STATUS:
+                breaker.record_failure()
+                raise AmbiguousWriteError(f"{method} {url}: outcome unknown: {last_err}")
             # мягкий backoff
             sleep_s = min(2 ** attempt, 25)
-            time.sleep(sleep_s)
-            continue
 
-        if resp.status_code >= 400:
-            raise HttpError(f"{resp.status_code} {url} -> {text[:1500]}")
+        # 429 — наш собственный перебор лимита (у Ozon — на кабинет), хост исправен:
+        # не сбой, но пробный запрос half-open он отпускает
+        if last_err.startswith("429 "):
+            breaker.record_neutral()
+        else:
+            breaker.record_failure()
+        if attempt >= retries:
+            break
+        if breaker.is_open:
+            # хост только что признан лежащим — не спим зря
+            raise CircuitOpenError(f"Circuit opened for {breaker.name}: {method} {url}: {last_err}")
+        if not budget.try_spend():
+            raise RetryableHttpError(f"Retry budget exhausted: {method} {url}: {last_err}")
+        time.sleep(sleep_s)
+
+    raise RetryableHttpError(f"HTTP request failed after {retries} attempts: {last_err}")
+
+
+def request_json(
+    method: str,
+    url: str,
+    *,
+    headers: Optional[Dict[str, str]] = None,
+    params: Optional[Dict[str, Any]] = None,
+    json_body: Optional[Dict[str, Any] | List[Dict[str, Any]]] = None,
+    data: Optional[bytes] = None,
+    timeout: int = 30,
+    retries: int = 8,
+    cache: Optional[ConditionalCache] = None,
+    throttle: Optional[Callable[[], None]] = None,
+    idempotent: bool = True,
+) -> Any:
+    """
+    Универсальный запрос с ретраями.
+    ВАЖНО: для MoySklad часто ловим 429 — делаем backoff.
+    json_body может быть списком (пакетное создание в МС) — тогда и ответ список.
+    data — уже закодированное тело (Content-Type задаёт вызывающий).
+    cache — для GET: условный запрос по сохранённым ETag/Last-Modified, на 304 — тело из кэша.
+    idempotent=False — для POST создания: при неизвестном исходе AmbiguousWriteError вместо повтора.
+    """
+    cache_key: Optional[str] = None
+    cached: Optional[Dict[str, Any]] = None
+    if cache is not None and method == "GET":
+        cache_key = cache.key(url, params)
+        cached = cache.get(cache_key)
+        if cached:
+            headers = dict(headers or {})
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+    resp = _send(method, url, headers=headers, params=params, json_body=json_body, timeout=timeout, retries=retries, data=data, throttle=throttle, idempotent=idempotent)
+
+    if resp.status_code == 304 and cached is not None:
+        return cached["body"]
+
+    # тело декодируем один раз — прямо из байтов, без промежуточного resp.text
+    body = resp.content or b""
+    if not body.strip():
+        return {}
+
+    try:
+        parsed = json.loads(body)
+    except ValueError as e:
+        raise HttpError(f"Invalid JSON from {url}: {body[:1500].decode('utf-8', 'replace')}") from e
+
+    if cache_key is not None:
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        if etag or last_modified:
+            cache.put(cache_key, etag, last_modified, parsed)
+    return parsed
+
+
+def iter_json_rows(
+    method: str,
+    url: str,
+    *,
+    headers: Optional[Dict[str, str]] = None,
+    params: Optional[Dict[str, Any]] = None,
+    timeout: int = 60,
+    retries: int = 8,
+    chunk_size: int = 64 * 1024,
+    throttle: Optional[Callable[[], None]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Потоковый разбор ответа вида {"...": ..., "rows": [{...}, {...}]}:
+    строки отдаются по одной по мере чтения тела, весь ответ в памяти не держим.
+    Ретраи — только до начала чтения тела (как в request_json).
+    """
+    resp = _send(method, url, headers=headers, params=params, json_body=None, timeout=timeout, retries=retries, stream=True, throttle=throttle)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parser = json.JSONDecoder()
 
-        if not text.strip():
-            return {}
+    buf = ""
+    pos = 0
+    in_rows = False
+    eof = False
+    chunks = resp.iter_content(chunk_size=chunk_size)
 
+    def _more() -> bool:
+        nonlocal buf, pos, eof
+        if eof:
+            return False
         try:
-            return resp.json()
-        except json.JSONDecodeError as e:
-            raise HttpError(f"Invalid JSON from {url}: {text[:1500]}") from e
+            chunk = next(chunks)
+        except StopIteration:
+            eof = True
+            buf = buf[pos:] + decoder.decode(b"", final=True)
+            pos = 0
+            return False
+        # отброшенное начало буфера не храним
+        buf = buf[pos:] + decoder.decode(chunk)
+        pos = 0
+        return True
+
+    try:
+        # 1) ищем начало массива rows
+        while not in_rows:
+            m = _ROWS_START.search(buf, pos)
+            if m:
+                pos = m.end()
+                in_rows = True
+                break
+            # ключ может быть разрезан границей чанка — хвост оставляем
+            pos = max(pos, len(buf) - 32)
+            if not _more():
+                return
 
-    raise HttpError(f"HTTP request failed after retries: {last_exc}")
+        # 2) элементы массива по одному
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                if not _more():
+                    raise HttpError(f"Truncated JSON rows from {url}")
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                row, end = parser.raw_decode(buf, pos)
+            except ValueError:
+                if not _more():
+                    raise HttpError(f"Invalid JSON rows from {url}: {buf[pos:pos + 500]}")
+                continue
+            pos = end
+            yield row
+    finally:
+        resp.close()
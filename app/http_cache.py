@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Any, Dict, Optional
+
+
+class ConditionalCache:
+    """
+    Кэш GET-ответов для условных запросов (ETag / Last-Modified).
+
+    По одному файлу на URL+params в каталоге FBO_CACHE_DIR/http.
+    При повторном чтении отправляем If-None-Match / If-Modified-Since;
+    на 304 тело берём из кэша — по сети ничего не качаем.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    @staticmethod
+    def key(url: str, params: Optional[Dict[str, Any]]) -> str:
+        raw = url + "?" + json.dumps(params or {}, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        return entry if isinstance(entry, dict) and "body" in entry else None
+
+    def put(self, key: str, etag: Optional[str], last_modified: Optional[str], body: Any) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"etag": etag, "last_modified": last_modified, "body": body}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def clear(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def stats(self) -> Dict[str, int]:
+        entries = 0
+        size = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    entries += 1
+                    try:
+                        size += os.path.getsize(os.path.join(root, name))
+                    except OSError:
+                        pass
+        return {"entries": entries, "bytes": size}
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+def parse_iso_dt(s: Optional[str]) -> Optional[datetime]:
+    if not s:
+        return None
+    s = s.strip()
+    # часто бывает Z
+    if s.endswith("Z"):
+        s = s[:-1] + "+00:00"
+    try:
+        return datetime.fromisoformat(s)
+    except Exception:
+        return None
+
+
+# ----------------------------
+# Ozon
+# ----------------------------
+
+
+class BundleItem:
+    """Товар внутри Ozon bundle: offer_id (= артикул в МС) и количество."""
+
+    __slots__ = ("offer_id", "quantity")
+
+    def __init__(self, offer_id: str, quantity: float) -> None:
+        self.offer_id = offer_id
+        self.quantity = quantity
+
+    @classmethod
+    def from_ozon(cls, it: Dict[str, Any]) -> Optional["BundleItem"]:
+        offer_id = it.get("offer_id")
+        qty = it.get("quantity")
+        if offer_id is None or qty is None:
+            return None
+        return cls(str(offer_id), float(qty))
+
+    def __repr__(self) -> str:
+        return f"BundleItem({self.offer_id!r}, {self.quantity!r})"
+
+
+class Supply:
+    """Одна поставка внутри заявки (order["supplies"][i])."""
+
+    __slots__ = ("bundle_id", "warehouse_name", "timeslot_from")
+
+    def __init__(self, bundle_id: Optional[str], warehouse_name: str, timeslot_from: Optional[datetime]) -> None:
+        self.bundle_id = bundle_id
+        self.warehouse_name = warehouse_name
+        self.timeslot_from = timeslot_from
+
+    @classmethod
+    def from_ozon(cls, s: Dict[str, Any]) -> "Supply":
+        wh = s.get("warehouse_name")
+        return cls(
+            bundle_id=str(s["bundle_id"]) if s.get("bundle_id") else None,
+            warehouse_name=str(wh) if wh else "",
+            timeslot_from=parse_iso_dt((s.get("timeslot") or {}).get("from")),
+        )
+
+
+class SupplyOrder:
+    """
+    Заявка на поставку из /v2/supply-order/get — разбирается один раз при получении,
+    сырой dict дальше не держим (только его отпечаток для change detection).
+    """
+
+    __slots__ = ("order_id", "order_number", "state", "supplies", "fingerprint")
+
+    def __init__(
+        self,
+        order_id: Optional[int],
+        order_number: str,
+        state: Optional[int],
+        supplies: List[Supply],
+        fingerprint: str,
+    ) -> None:
+        self.order_id = order_id
+        self.order_number = order_number
+        self.state = state
+        self.supplies = supplies
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_ozon(cls, o: Dict[str, Any]) -> "SupplyOrder":
+        raw_id = o.get("supply_order_id") or o.get("order_id") or o.get("id")
+        try:
+            order_id: Optional[int] = int(raw_id) if raw_id is not None else None
+        except (TypeError, ValueError):
+            order_id = None
+        try:
+            state: Optional[int] = int(o["state"]) if o.get("state") is not None else None
+        except (TypeError, ValueError):
+            state = None
+
+        raw = json.dumps(o, sort_keys=True, ensure_ascii=False, default=str)
+        return cls(
+            order_id=order_id,
+            order_number=str(o.get("order_number") or raw_id or ""),
+            state=state,
+            supplies=[Supply.from_ozon(s) for s in (o.get("supplies") or [])],
+            fingerprint=hashlib.sha1(raw.encode("utf-8")).hexdigest(),
+        )
+
+    # в данных Ozon всё нужное лежит в первой поставке заявки
+    @property
+    def timeslot(self) -> Optional[datetime]:
+        return self.supplies[0].timeslot_from if self.supplies else None
+
+    @property
+    def warehouse_name(self) -> str:
+        return self.supplies[0].warehouse_name if self.supplies else ""
+
+    @property
+    def bundle_id(self) -> Optional[str]:
+        return self.supplies[0].bundle_id if self.supplies else None
+
+    def __repr__(self) -> str:
+        return f"SupplyOrder({self.order_id!r}, {self.order_number!r}, state={self.state!r})"
+
+
+# ----------------------------
+# MoySklad
+# ----------------------------
+
+
+class MsAssortment:
+    """Строка /entity/assortment: только то, что нужно для разворачивания в позиции."""
+
+    __slots__ = ("id", "type", "meta")
+
+    def __init__(self, id: Optional[str], type: Optional[str], meta: Dict[str, Any]) -> None:
+        self.id = id
+        self.type = type
+        self.meta = meta
+
+    @classmethod
+    def from_ms(cls, row: Dict[str, Any]) -> "MsAssortment":
+        meta = row.get("meta") or {}
+        return cls(id=row.get("id"), type=meta.get("type") or row.get("type"), meta=meta)
+
+    @property
+    def href(self) -> Optional[str]:
+        return self.meta.get("href")
+
+    @property
+    def is_bundle(self) -> bool:
+        return self.type == "bundle"
+
+
+class MsPosition:
+    """
+    Позиция документа МС. В payload превращается только при записи (to_payload).
+    """
+
+    __slots__ = ("meta", "quantity", "price")
+
+    def __init__(self, meta: Dict[str, Any], quantity: float, price: int = 0) -> None:
+        self.meta = meta
+        self.quantity = quantity
+        self.price = price
+
+    @classmethod
+    def from_payload(cls, p: Dict[str, Any]) -> Optional["MsPosition"]:
+        meta = ((p.get("assortment") or {}).get("meta")) or {}
+        if not meta.get("href"):
+            return None
+        return cls(meta, float(p.get("quantity") or 0), int(p.get("price") or 0))
+
+    @property
+    def href(self) -> str:
+        return self.meta.get("href") or ""
+
+    def to_payload(self) -> Dict[str, Any]:
+        return {"assortment": {"meta": self.meta}, "quantity": self.quantity, "price": self.price}
+
+    def __repr__(self) -> str:
+        return f"MsPosition({self.href!r}, {self.quantity!r}, {self.price!r})"
+
+
+def positions_payload(positions: List[MsPosition]) -> List[Dict[str, Any]]:
+    return [p.to_payload() for p in positions]
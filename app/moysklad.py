@@ -1,21 +1,106 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Any, Dict, Optional
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
-from .http import request_json
+from .assortment_index import AssortmentIndex
+from .http import AmbiguousWriteError, iter_json_rows, request_json
+from .http_cache import ConditionalCache
+from .models import MsAssortment, MsPosition
+from .ms_refs import MsRefs, refs_for
+from .rate_limit import FairRateBudget
+from .write_journal import WriteJournal
+
+
+# поля документа, которых хватает для dedup по externalCode и связи документов
+LOOKUP_FIELDS = ("id", "name", "externalCode", "updated", "applicable")
+
+# сколько раз create() проверяет-и-повторяет POST с неизвестным исходом
+CREATE_ATTEMPTS = 3
+
+
+def project(doc: Dict[str, Any], fields: Optional[Sequence[str]]) -> Dict[str, Any]:
+    """
+    Оставляет в документе только нужные поля верхнего уровня (meta — всегда).
+    """
+    if not fields:
+        return doc
+    return {k: doc[k] for k in ("meta", *fields) if k in doc}
+
+
+@dataclass(frozen=True)
+class MsWriteResult:
+    """
+    Результат ensure/create/update документа МС.
+    doc — полный документ из ответа МС (или найденный по externalCode),
+    поэтому id/meta для связанных документов не нужно перезапрашивать.
+    """
+    action: str
+    entity: str
+    doc: Dict[str, Any] = field(default_factory=dict, repr=False)
+    name: Optional[str] = None
+    external_code: Optional[str] = None
+
+    @classmethod
+    def from_doc(cls, action: str, entity: str, doc: Optional[Dict[str, Any]], **kw: Any) -> "MsWriteResult":
+        return cls(action=action, entity=entity, doc=doc or {}, **kw)
+
+    @property
+    def id(self) -> Optional[str]:
+        return self.doc.get("id")
+
+    @property
+    def meta(self) -> Optional[Dict[str, Any]]:
+        return self.doc.get("meta")
+
+    @property
+    def updated(self) -> Optional[str]:
+        return self.doc.get("updated")
+
+    def ref(self) -> Optional[Dict[str, Any]]:
+        """{"meta": ...} для ссылки на документ из других документов."""
+        return {"meta": self.meta} if self.meta else None
+
+    def as_log(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"action": self.action, "entity": self.entity, "id": self.id}
+        if self.name is not None:
+            out["name"] = self.name
+        if self.external_code is not None:
+            out["externalCode"] = self.external_code
+        if self.updated:
+            out["updated"] = self.updated
+        return out
 
 
 @dataclass(frozen=True)
 class MoySkladClient:
     token: str
     base_url: str = "https://api.moysklad.ru/api/remap/1.2"
+    # TTL кэша справочных чтений (ассортимент, компоненты комплектов, товары).
+    # 0 — без кэша (поведение one-shot скрипта).
+    cache_ttl_s: int = 0
+    _cache: Dict[Tuple[str, str], Tuple[float, Any]] = field(default_factory=dict, compare=False, repr=False)
+    # условные GET (ETag/Last-Modified) для справочных чтений; None — без них
+    http_cache: Optional[ConditionalCache] = field(default=None, compare=False, repr=False)
+    # локальный снимок ассортимента (delta по updated>=); None — только живой поиск
+    assortment_index: Optional[AssortmentIndex] = field(default=None, compare=False, repr=False)
+    # общий на все кабинеты бюджет запросов к МС; None — без ограничения
+    rate_budget: Optional[FairRateBudget] = field(default=None, compare=False, repr=False)
+    # журнал намерений создания (переживает падение процесса); None — только проверка при таймауте
+    journal: Optional[WriteJournal] = field(default=None, compare=False, repr=False)
+
+    @property
+    def _throttle(self) -> Optional[Callable[[], None]]:
+        return self.rate_budget.acquire if self.rate_budget is not None else None
 
     @property
     def auth_headers(self) -> Dict[str, str]:
         return {
             "Authorization": f"Bearer {self.token}",
             "Accept": "application/json;charset=utf-8",
+            "Accept-Encoding": "gzip",
         }
 
     def _headers_for_json(self) -> Dict[str, str]:
@@ -23,17 +108,138 @@ class MoySkladClient:
         h["Content-Type"] = "application/json;charset=utf-8"
         return h
 
-    def get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        return request_json("GET", self.base_url + path, headers=self.auth_headers, params=params)
+    def get(
+        self,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        conditional: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        fields — проекция строк rows на нужные поля. Тело к этому моменту уже
+        разобрано целиком, так что пик памяти проекция не снижает — только то,
+        что вызывающий держит дальше. Большие выборки — через iter_rows().
+        conditional — условный запрос через http_cache (если он задан).
+        """
+        cache = self.http_cache if conditional else None
+        res = request_json("GET", self.base_url + path, headers=self.auth_headers, params=params, cache=cache, throttle=self._throttle)
+        if fields and isinstance(res.get("rows"), list):
+            res["rows"] = [project(r, fields) for r in res["rows"]]
+        return res
+
+    def iter_rows(
+        self,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        fields: Optional[Sequence[str]] = None,
+        page_limit: int = 1000,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Постраничный потоковый обход rows (limit/offset): каждая страница
+        разбирается по строкам, строки сразу проецируются на fields —
+        в памяти не держим ни страницу целиком, ни лишние поля.
+        Единственный путь, где память ограничена: у МС нет параметра,
+        сужающего поля ответа (fields= только добавляет, например stock),
+        поэтому всё отбрасывается на нашей стороне.
+        """
+        offset = 0
+        while True:
+            page_params = dict(params or {}, limit=page_limit, offset=offset)
+            n = 0
+            for row in iter_json_rows("GET", self.base_url + path, headers=self.auth_headers, params=page_params, throttle=self._throttle):
+                n += 1
+                yield project(row, fields)
+            if n < page_limit:
+                break
+            offset += page_limit
+
+    @property
+    def refs(self) -> MsRefs:
+        return refs_for(self.base_url)
+
+    def _encode(self, payload: Any) -> bytes:
+        # один проход C-кодировщика по всему телу, компактно и без \u-экранирования
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def post(self, path: str, payload: Dict[str, Any] | List[Dict[str, Any]]) -> Any:
+        return request_json("POST", self.base_url + path, headers=self._headers_for_json(), data=self._encode(payload), throttle=self._throttle)
+
+    def create(self, entity: str, payload: Dict[str, Any] | List[Dict[str, Any]]) -> Any:
+        """
+        POST /entity/<entity> создания (объект или массив) без дублей при повторах.
+
+        - перед POST externalCode документов пишутся в журнал намерений;
+        - если исход POST неизвестен (AmbiguousWriteError) или намерение осталось
+          от прошлой попытки — документ сначала ищется по externalCode, и заново
+          отправляются только ненайденные;
+        - элементы массива с meta (обновления) просто отправляются повторно.
+        Ответ — как у post(): документ или список в порядке payload.
+        """
+        single = not isinstance(payload, list)
+        items: List[Dict[str, Any]] = [payload] if single else list(payload)
+        out: List[Any] = [None] * len(items)
+        todo = list(range(len(items)))
+        # без externalCode созданный документ не найти — такой пакет при неизвестном исходе не повторяем
+        verifiable = all(it.get("meta") or it.get("externalCode") for it in items)
+
+        def _ext(i: int) -> Optional[str]:
+            return None if items[i].get("meta") else items[i].get("externalCode")
+
+        last_exc: Optional[AmbiguousWriteError] = None
+        for attempt in range(CREATE_ATTEMPTS):
+            # после неизвестного исхода проверяем всё, иначе — недописанные намерения прошлых попыток
+            for i in list(todo):
+                ext = _ext(i)
+                if not ext or not (attempt or (self.journal is not None and self.journal.is_pending(entity, ext))):
+                    continue
+                rows = self.get(f"/entity/{entity}", params={"filter": f"externalCode={ext}", "limit": 1}).get("rows") or []
+                if rows:
+                    print({"action": "create_recovered_by_external", "entity": entity, "externalCode": ext, "id": rows[0].get("id")})
+                    out[i] = rows[0]
+                    todo.remove(i)
+                    if self.journal is not None:
+                        self.journal.resolve(entity, [ext])
+            if not todo:
+                break
+
+            exts = [e for e in map(_ext, todo) if e]
+            if self.journal is not None:
+                self.journal.begin(entity, exts)
+
+            body: Any = items[todo[0]] if single else [items[i] for i in todo]
+            try:
+                res = request_json(
+                    "POST", f"{self.base_url}/entity/{entity}", headers=self._headers_for_json(),
+                    data=self._encode(body), throttle=self._throttle, idempotent=False,
+                )
+            except AmbiguousWriteError as e:
+                print({"action": "create_outcome_unknown", "entity": entity, "externalCodes": exts, "error": str(e)[:300]})
+                if not verifiable:
+                    raise
+                last_exc = e
+                continue
+            except Exception:
+                # МС ответил ошибкой — документы точно не созданы
+                if self.journal is not None:
+                    self.journal.resolve(entity, exts)
+                raise
 
-    def post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-        return request_json("POST", self.base_url + path, headers=self._headers_for_json(), json_body=payload)
+            for i, doc in zip(todo, res if isinstance(res, list) else [res]):
+                out[i] = doc
+            if self.journal is not None:
+                self.journal.resolve(entity, exts)
+            todo = []
+            break
+
+        if todo and last_exc is not None:
+            raise last_exc
+        return out[0] if single else out
 
     def put(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-        return request_json("PUT", self.base_url + path, headers=self._headers_for_json(), json_body=payload)
+        return request_json("PUT", self.base_url + path, headers=self._headers_for_json(), data=self._encode(payload), throttle=self._throttle)
 
     def delete(self, path: str) -> Dict[str, Any]:
-        return request_json("DELETE", self.base_url + path, headers=self.auth_headers)
+        return request_json("DELETE", self.base_url + path, headers=self.auth_headers, throttle=self._throttle)
 
     # -------- helpers --------
 
@@ -41,25 +247,37 @@ class MoySkladClient:
         """
         Удобный builder для meta-ссылок МС.
         Пример: ms.meta("organization", "uuid") -> {"meta": {...}}
+        Объект общий (из реестра MsRefs) — не менять на месте.
         """
-        return {
-            "meta": {
-                "href": f"{self.base_url}/entity/{entity}/{entity_id}",
-                "type": entity,
-                "mediaType": "application/json",
-            }
-        }
+        return self.refs.ref(entity, entity_id)
+
+    def _cached(self, kind: str, key: str, loader: Callable[[], Any]) -> Any:
+        if self.cache_ttl_s <= 0:
+            return loader()
+        now = time.monotonic()
+        hit = self._cache.get((kind, key))
+        if hit is not None and hit[0] > now:
+            return hit[1]
+        value = loader()
+        self._cache[(kind, key)] = (now + self.cache_ttl_s, value)
+        return value
 
     def get_by_href(self, href: str) -> Dict[str, Any]:
-        return request_json("GET", href, headers=self.auth_headers)
+        return self._cached("href", href, lambda: request_json("GET", href, headers=self.auth_headers, cache=self.http_cache, throttle=self._throttle))
 
     def get_bundle_components(self, bundle_id: str) -> list[Dict[str, Any]]:
         # Компоненты комплекта:
         # /entity/bundle/{bundle_id}/components
-        res = self.get(f"/entity/bundle/{bundle_id}/components")
-        return res.get("rows") or []
+        def load() -> list[Dict[str, Any]]:
+            res = self.get(f"/entity/bundle/{bundle_id}/components", conditional=True)
+            return res.get("rows") or []
+
+        return self._cached("bundle_components", bundle_id, load)
 
     def find_assortment_by_article(self, article: str) -> Optional[Dict[str, Any]]:
+        return self._cached("assortment", article, lambda: self._find_assortment_by_article(article))
+
+    def _find_assortment_by_article(self, article: str) -> Optional[Dict[str, Any]]:
         # 1) Прямой фильтр по article
         res = self.get("/entity/assortment", params={"filter": f"article={article}", "limit": 1})
         rows = res.get("rows") or []
@@ -82,3 +300,38 @@ class MoySkladClient:
             if v:
                 return int(v)
         return 0
+
+    # -------- typed (модели разбираются один раз, кэшируются компактно) --------
+
+    def find_assortment(self, article: str) -> Optional[MsAssortment]:
+        def load() -> Optional[MsAssortment]:
+            row = self.assortment_index.find(article) if self.assortment_index is not None else None
+            if row is None:
+                row = self._find_assortment_by_article(article)
+            if not row:
+                return None
+            a = MsAssortment.from_ms(row)
+            a.meta = self.refs.intern_meta(a.meta)
+            return a
+
+        return self._cached("assortment_model", article, load)
+
+    def get_bundle_component_positions(self, bundle_id: str) -> list[MsPosition]:
+        """Компоненты комплекта как позиции (quantity — на 1 комплект, без цены)."""
+        def load() -> list[MsPosition]:
+            out: list[MsPosition] = []
+            for r in self.get(f"/entity/bundle/{bundle_id}/components", conditional=True).get("rows") or []:
+                meta = ((r.get("assortment") or {}).get("meta")) or {}
+                cqty = r.get("quantity")
+                if meta.get("href") and cqty:
+                    out.append(MsPosition(self.refs.intern_meta(meta), float(cqty)))
+            return out
+
+        return self._cached("bundle_positions", bundle_id, load)
+
+    def get_sale_price_by_href(self, href: str) -> int:
+        # в кэше — только цена, а не весь документ товара
+        return self._cached(
+            "sale_price", href,
+            lambda: self.get_sale_price(request_json("GET", href, headers=self.auth_headers, cache=self.http_cache, throttle=self._throttle)),
+        )
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, List
+
+from .http import HttpError
+from .moysklad import MoySkladClient, MsWriteResult
+
+# код ошибки МС «нельзя провести: нет остатков» (и для move, и для demand)
+NOT_ENOUGH_STOCK_CODE = 3007
+
+_STOCK_CODE_RE = re.compile(r'"code"\s*:\s*%d\b' % NOT_ENOUGH_STOCK_CODE)
+
+
+def is_not_enough_stock(msg: Any) -> bool:
+    """
+    МС отказывает в проведении из-за остатков:
+    “Нельзя переместить товар, которого нет на складе” / code 3007.
+    msg — текст ошибки (тело ответа МС внутри HttpError) или errors элемента
+    пакетного ответа (dict / список dict) — тогда сверяется code каждого.
+    """
+    if isinstance(msg, dict):
+        msg = [msg]
+    if isinstance(msg, list):
+        return any(isinstance(e, dict) and e.get("code") == NOT_ENOUGH_STOCK_CODE for e in msg)
+    s = msg if isinstance(msg, str) else str(msg)
+    return "Нельзя переместить товар" in s or _STOCK_CODE_RE.search(s) is not None
+
+
+def _item_errors(doc: Dict[str, Any]) -> List[Dict[str, Any]]:
+    errs = doc.get("errors") if isinstance(doc, dict) else None
+    return errs if isinstance(errs, list) else []
+
+
+def create_applied(ms: MoySkladClient, entity: str, payload: Dict[str, Any]) -> MsWriteResult:
+    """
+    Одна запись вместо create + apply:
+    сначала создаём сразу проведённым, и только если МС отказал по остаткам —
+    создаём не проведённым. Прочие ошибки пробрасываются как есть.
+    """
+    name = payload.get("name")
+    ext = payload.get("externalCode")
+    try:
+        doc = ms.create(entity, dict(payload, applicable=True))
+        return MsWriteResult.from_doc(f"{entity}_created_applied", entity, doc, name=name, external_code=ext)
+    except HttpError as e:
+        if not is_not_enough_stock(e):
+            raise
+
+    doc = ms.create(entity, dict(payload, applicable=False))
+    return MsWriteResult.from_doc(f"{entity}_created_unapplied", entity, doc, name=name, external_code=ext)
+
+
+def update_applied(ms: MoySkladClient, entity: str, doc_id: str, body: Dict[str, Any]) -> MsWriteResult:
+    """
+    То же для обновления: PUT изменений вместе с applicable=True,
+    при отказе по остаткам — тот же PUT с applicable=False.
+    """
+    try:
+        doc = ms.put(f"/entity/{entity}/{doc_id}", dict(body, applicable=True))
+        return MsWriteResult.from_doc(f"{entity}_updated_applied", entity, doc)
+    except HttpError as e:
+        if not is_not_enough_stock(e):
+            raise
+
+    doc = ms.put(f"/entity/{entity}/{doc_id}", dict(body, applicable=False))
+    return MsWriteResult.from_doc(f"{entity}_updated_unapplied", entity, doc)
+
+
+def create_applied_batch(ms: MoySkladClient, entity: str, payloads: List[Dict[str, Any]]) -> List[MsWriteResult]:
+    """
+    Пакетный вариант: один POST массивом, все документы проведёнными.
+    - документы, которым МС отказал по остаткам, пересоздаются не проведёнными
+      (одним POST-массивом);
+    - если МС отклонил весь пакет по остаткам — падаем на create_applied по одному;
+    - прочие ошибки элемента -> результат "<entity>_create_failed" с errors в doc.
+    Порядок результатов совпадает с payloads.
+    """
+    if not payloads:
+        return []
+
+    try:
+        docs = ms.create(entity, [dict(p, applicable=True) for p in payloads])
+    except HttpError as e:
+        if not is_not_enough_stock(e):
+            raise
+        return [create_applied(ms, entity, p) for p in payloads]
+
+    if not isinstance(docs, list) or len(docs) != len(payloads):
+        raise HttpError(f"Unexpected batch response for {entity}: {str(docs)[:500]}")
+
+    results: List[MsWriteResult] = []
+    retry_idx: List[int] = []
+    for i, (p, doc) in enumerate(zip(payloads, docs)):
+        errs = _item_errors(doc)
+        if not errs:
+            results.append(MsWriteResult.from_doc(f"{entity}_created_applied", entity, doc, name=p.get("name"), external_code=p.get("externalCode")))
+        elif is_not_enough_stock(errs):
+            retry_idx.append(i)
+            results.append(MsWriteResult.from_doc(f"{entity}_create_failed", entity, {}, name=p.get("name"), external_code=p.get("externalCode")))
+        else:
+            results.append(MsWriteResult.from_doc(f"{entity}_create_failed", entity, {"errors": errs}, name=p.get("name"), external_code=p.get("externalCode")))
+
+    if retry_idx:
+        docs = ms.create(entity, [dict(payloads[i], applicable=False) for i in retry_idx])
+        for i, doc in zip(retry_idx, docs if isinstance(docs, list) else []):
+            p = payloads[i]
+            errs = _item_errors(doc)
+            action = f"{entity}_create_failed" if errs else f"{entity}_created_unapplied"
+            results[i] = MsWriteResult.from_doc(action, entity, {"errors": errs} if errs else doc, name=p.get("name"), external_code=p.get("externalCode"))
+
+    return results
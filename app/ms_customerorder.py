@@ -4,7 +4,8 @@ from dataclasses import dataclass
 from datetime import datetime
 from typing import Any, Dict, List, Optional
 
-from .moysklad import MoySkladClient
+from .moysklad import LOOKUP_FIELDS, MoySkladClient, MsWriteResult
+from .ms_refs import refs_for
 
 MS_BASE = "https://api.moysklad.ru/api/remap/1.2"
 FBO_EXT_PREFIX = "OZON_FBO:"
@@ -15,13 +16,8 @@ def fbo_external_code(order_number: str) -> str:
 
 
 def _ms_ref(entity: str, id_: str) -> Dict[str, Any]:
-    return {
-        "meta": {
-            "href": f"{MS_BASE}/entity/{entity}/{id_}",
-            "type": entity,
-            "mediaType": "application/json",
-        }
-    }
+    # общий объект из реестра: повторно не строится и не сериализуется
+    return refs_for(MS_BASE).ref(entity, id_)
 
 
 @dataclass(frozen=True)
@@ -54,12 +50,18 @@ def build_customerorder_payload(d: CustomerOrderDraft, positions: list[dict]) ->
     return payload
 
 
-def create_customerorder(ms: MoySkladClient, payload: Dict[str, Any]) -> Dict[str, Any]:
-    return ms.post("/entity/customerorder", payload)
+def create_customerorder(ms: MoySkladClient, payload: Dict[str, Any]) -> MsWriteResult:
+    doc = ms.create("customerorder", payload)
+    return MsWriteResult.from_doc("created", "customerorder", doc, name=payload.get("name"), external_code=payload.get("externalCode"))
+
+
+def update_customerorder(ms: MoySkladClient, order_id: str, payload: Dict[str, Any]) -> MsWriteResult:
+    doc = ms.put(f"/entity/customerorder/{order_id}", payload)
+    return MsWriteResult.from_doc("updated", "customerorder", doc, name=payload.get("name"), external_code=payload.get("externalCode"))
 
 
 def find_customerorders_by_external(ms: MoySkladClient, external_code: str, limit: int = 100) -> List[Dict[str, Any]]:
-    res = ms.get("/entity/customerorder", params={"filter": f"externalCode={external_code}", "limit": limit})
+    res = ms.get("/entity/customerorder", params={"filter": f"externalCode={external_code}", "limit": limit}, fields=LOOKUP_FIELDS)
     return (res.get("rows") or [])
 
 
@@ -92,7 +94,12 @@ def dedup_customerorders_by_external(ms: MoySkladClient, external_code: str, dry
     return keep
 
 
-def ensure_customerorder(ms: MoySkladClient, payload: Dict[str, Any], dry_run: bool) -> Dict[str, Any]:
+def ensure_customerorder(ms: MoySkladClient, payload: Dict[str, Any], dry_run: bool) -> MsWriteResult:
+    """
+    Создаёт или обновляет заказ по externalCode.
+    Возвращает документ из ответа МС — id/meta сразу годятся для move/demand.
+    В dry_run doc — найденный существующий заказ (или пустой, если его нет).
+    """
     ext = payload.get("externalCode")
     if not ext:
         raise ValueError("customerorder payload missing externalCode")
@@ -100,11 +107,10 @@ def ensure_customerorder(ms: MoySkladClient, payload: Dict[str, Any], dry_run: b
     keep = dedup_customerorders_by_external(ms, ext, dry_run=dry_run)
 
     if dry_run:
-        return {"action": "dry_run_update" if keep else "dry_run_create", "externalCode": ext, "name": payload.get("name")}
+        action = "dry_run_update" if keep else "dry_run_create"
+        return MsWriteResult.from_doc(action, "customerorder", keep, name=payload.get("name"), external_code=ext)
 
     if keep:
-        ms.put(f"/entity/customerorder/{keep['id']}", payload)
-        return {"action": "updated", "id": keep["id"], "name": payload.get("name"), "updated": True}
+        return update_customerorder(ms, keep["id"], payload)
 
-    created = create_customerorder(ms, payload)
-    return {"action": "created", "id": created.get("id"), "name": payload.get("name"), "created": True}
+    return create_customerorder(ms, payload)
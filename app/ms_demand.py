@@ -1,13 +1,15 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Sequence
 
-from .moysklad import MoySkladClient
+from .moysklad import LOOKUP_FIELDS, MoySkladClient, MsWriteResult
 from .http import HttpError
+from .models import MsPosition
+from .ms_apply import create_applied
 
 
 def _find_demands_by_external(ms: MoySkladClient, external_code: str) -> List[Dict[str, Any]]:
-    res = ms.get("/entity/demand", params={"filter": f"externalCode={external_code}", "limit": 100})
+    res = ms.get("/entity/demand", params={"filter": f"externalCode={external_code}", "limit": 100}, fields=LOOKUP_FIELDS)
     return res.get("rows") or []
 
 
@@ -35,12 +37,19 @@ def dedup_demands_by_external(ms: MoySkladClient, external_code: str, dry_run: b
     return keep
 
 
-def create_demand(ms: MoySkladClient, payload: Dict[str, Any]) -> Dict[str, Any]:
-    return ms.post("/entity/demand", payload)
+def create_demand(ms: MoySkladClient, payload: Dict[str, Any]) -> MsWriteResult:
+    doc = ms.create("demand", payload)
+    return MsWriteResult.from_doc("demand_created", "demand", doc, name=payload.get("name"), external_code=payload.get("externalCode"))
 
 
-def update_demand_positions_only(ms: MoySkladClient, demand_id: str, positions: List[Dict[str, Any]]) -> Dict[str, Any]:
-    return ms.put(f"/entity/demand/{demand_id}", {"positions": positions})
+def update_demand_positions_only(ms: MoySkladClient, demand_id: str, positions: List[Dict[str, Any]]) -> MsWriteResult:
+    doc = ms.put(f"/entity/demand/{demand_id}", {"positions": positions})
+    return MsWriteResult.from_doc("demand_updated", "demand", doc)
+
+
+def create_demand_applied(ms: MoySkladClient, payload: Dict[str, Any]) -> MsWriteResult:
+    """Создание сразу проведённой; без остатков — не проведённой (одна запись в норме)."""
+    return create_applied(ms, "demand", payload)
 
 
 def try_apply_demand(ms: MoySkladClient, demand_id: str) -> Dict[str, Any]:
@@ -51,9 +60,13 @@ def try_apply_demand(ms: MoySkladClient, demand_id: str) -> Dict[str, Any]:
         return {"action": "demand_left_unapplied", "id": demand_id, "error": str(e)[:300]}
 
 
-def build_demand_positions_from_order_positions(order_positions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def build_demand_positions_from_order_positions(order_positions: Sequence[MsPosition | Dict[str, Any]]) -> List[Dict[str, Any]]:
     out: List[Dict[str, Any]] = []
     for p in order_positions:
+        if isinstance(p, MsPosition):
+            if p.quantity:
+                out.append(p.to_payload())
+            continue
         ass = p.get("assortment") or {}
         qty = p.get("quantity")
         price = p.get("price", 0)
@@ -1,13 +1,15 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Sequence
 
-from .moysklad import MoySkladClient
+from .moysklad import LOOKUP_FIELDS, MoySkladClient, MsWriteResult
 from .http import HttpError
+from .models import MsPosition
+from .ms_apply import create_applied, is_not_enough_stock, update_applied
 
 
 def _find_moves_by_external(ms: MoySkladClient, external_code: str) -> List[Dict[str, Any]]:
-    res = ms.get("/entity/move", params={"filter": f"externalCode={external_code}", "limit": 100})
+    res = ms.get("/entity/move", params={"filter": f"externalCode={external_code}", "limit": 100}, fields=LOOKUP_FIELDS)
     return res.get("rows") or []
 
 
@@ -36,16 +38,28 @@ def dedup_moves_by_external(ms: MoySkladClient, external_code: str, dry_run: boo
     return keep
 
 
-def create_move(ms: MoySkladClient, payload: Dict[str, Any]) -> Dict[str, Any]:
-    return ms.post("/entity/move", payload)
+def create_move(ms: MoySkladClient, payload: Dict[str, Any]) -> MsWriteResult:
+    doc = ms.create("move", payload)
+    return MsWriteResult.from_doc("move_created", "move", doc, name=payload.get("name"), external_code=payload.get("externalCode"))
 
 
-def update_move_positions_only(ms: MoySkladClient, move_id: str, positions: List[Dict[str, Any]]) -> Dict[str, Any]:
-    return ms.put(f"/entity/move/{move_id}", {"positions": positions})
+def update_move_positions_only(ms: MoySkladClient, move_id: str, positions: List[Dict[str, Any]]) -> MsWriteResult:
+    doc = ms.put(f"/entity/move/{move_id}", {"positions": positions})
+    return MsWriteResult.from_doc("move_updated", "move", doc)
+
+
+def create_move_applied(ms: MoySkladClient, payload: Dict[str, Any]) -> MsWriteResult:
+    """Создание сразу проведённым; без остатков — не проведённым (одна запись в норме)."""
+    return create_applied(ms, "move", payload)
+
+
+def update_move_positions_applied(ms: MoySkladClient, move_id: str, positions: List[Dict[str, Any]]) -> MsWriteResult:
+    """Позиции + проведение одним PUT; без остатков — позиции без проведения."""
+    return update_applied(ms, "move", move_id, {"positions": positions})
 
 
 # совместимость с твоими импортами
-def update_move_positions_only_(ms: MoySkladClient, move_id: str, positions: List[Dict[str, Any]]) -> Dict[str, Any]:
+def update_move_positions_only_(ms: MoySkladClient, move_id: str, positions: List[Dict[str, Any]]) -> MsWriteResult:
     return update_move_positions_only(ms, move_id, positions)
 
 
@@ -56,14 +70,18 @@ def try_apply_move(ms: MoySkladClient, move_id: str) -> Dict[str, Any]:
     except HttpError as e:
         msg = str(e)
         # “Нельзя переместить товар, которого нет на складе”
-        if "Нельзя переместить товар" in msg or "code\" : 3007" in msg:
+        if is_not_enough_stock(msg):
             return {"action": "move_left_unapplied", "id": move_id, "reason": "not_enough_stock"}
         return {"action": "move_apply_failed", "id": move_id, "error": msg[:300]}
 
 
-def build_move_positions_from_order_positions(order_positions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def build_move_positions_from_order_positions(order_positions: Sequence[MsPosition | Dict[str, Any]]) -> List[Dict[str, Any]]:
     out: List[Dict[str, Any]] = []
     for p in order_positions:
+        if isinstance(p, MsPosition):
+            if p.quantity:
+                out.append(p.to_payload())
+            continue
         ass = p.get("assortment") or {}
         qty = p.get("quantity")
         price = p.get("price", 0)
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+# сколько ссылок/meta держит реестр (LRU): справочники и ходовые товары
+# остаются общими, а ссылки на отдельные документы (ms.meta("customerorder", id)
+# для delete/update) вытесняются и в daemon-режиме не копятся бесконечно
+REFS_MAX = 4096
+
+
+class MsRefs:
+    """
+    Реестр meta-ссылок МС.
+
+    Каждая ссылка ({"meta": {...}}) строится один раз и дальше переиспользуется
+    одним и тем же объектом, пока не вытеснена (REFS_MAX, LRU); meta товаров
+    интернируются по href. Кодирование тела — обычный json.dumps (см. MoySkladClient._encode).
+
+    ВАЖНО: отданные реестром объекты общие — их нельзя менять на месте.
+    """
+
+    def __init__(self, base_url: str, max_size: int = REFS_MAX) -> None:
+        self.base_url = base_url
+        self.max_size = max_size
+        self._refs: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._metas: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, d: "OrderedDict[Any, Dict[str, Any]]", key: Any) -> Any:
+        v = d.get(key)
+        if v is not None:
+            d.move_to_end(key)
+        return v
+
+    def _store(self, d: "OrderedDict[Any, Dict[str, Any]]", key: Any, value: Dict[str, Any]) -> None:
+        d[key] = value
+        if len(d) > self.max_size:
+            d.popitem(last=False)
+
+    def ref(self, entity: str, entity_id: str) -> Dict[str, Any]:
+        key = (entity, entity_id)
+        with self._lock:
+            r = self._lookup(self._refs, key)
+        if r is None:
+            meta = self.intern_meta(
+                {
+                    "href": f"{self.base_url}/entity/{entity}/{entity_id}",
+                    "type": entity,
+                    "mediaType": "application/json",
+                }
+            )
+            r = {"meta": meta}
+            with self._lock:
+                self._store(self._refs, key, r)
+        return r
+
+    def intern_meta(self, meta: Dict[str, Any]) -> Dict[str, Any]:
+        """Канонический объект meta по href (для позиций: одни и те же товары во многих документах)."""
+        href = meta.get("href")
+        if not href:
+            return meta
+        with self._lock:
+            m = self._lookup(self._metas, href)
+            if m is None:
+                m = meta
+                self._store(self._metas, href, m)
+        return m
+
+
+_registries: Dict[str, MsRefs] = {}
+
+
+def refs_for(base_url: str) -> MsRefs:
+    """Один реестр на base_url в процессе."""
+    r = _registries.get(base_url)
+    if r is None:
+        r = _registries[base_url] = MsRefs(base_url)
+    return r
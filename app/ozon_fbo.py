@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Any, Dict, Optional, Iterator, List
+from typing import Any, Dict, Optional, Iterator, List, Tuple
 
 from .http import request_json
+from .models import BundleItem, SupplyOrder
 
 
 @dataclass(frozen=True)
@@ -18,6 +19,7 @@ class OzonFboClient:
             "Client-Id": str(self.client_id),
             "Api-Key": str(self.api_key),
             "Content-Type": "application/json; charset=utf-8",
+            "Accept-Encoding": "gzip",
         }
 
     def post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -54,27 +56,37 @@ class OzonFboClient:
 
         return self.post("/v3/supply-order/list", payload)
 
-    def iter_supply_order_ids(self, state: int, limit: int = 100) -> Iterator[int]:
+    def iter_supply_order_pages(
+        self, state: int, limit: int = 100, from_supply_order_id: int = 0
+    ) -> Iterator[Tuple[int, List[int]]]:
         """
-        Постраничный обход order_ids по state.
+        Постраничный обход по state: отдаёт (from_supply_order_id страницы, order_ids).
+        Курсор страницы можно сохранить и потом продолжить обход с него.
         """
-        last = 0
+        last = int(from_supply_order_id)
         while True:
             data = self.list_supply_order_ids(state=state, limit=limit, from_supply_order_id=last)
-            ids = data.get("order_ids") or []
-            for oid in ids:
-                if isinstance(oid, int):
-                    yield oid
+            ids = [oid for oid in (data.get("order_ids") or []) if isinstance(oid, int)]
 
             # В ответе Ozon часто отдает "last_id" (строка), но для from_supply_order_id нужен int.
             # Поэтому безопаснее двигаться по максимуму из ids.
             if not ids:
                 break
 
-            last = max(ids)
+            yield last, ids
+
+            nxt = max(ids)
             # Иногда API может отдавать повторно тот же last — защита:
-            if last <= 0:
+            if nxt <= 0 or nxt <= last:
                 break
+            last = nxt
+
+    def iter_supply_order_ids(self, state: int, limit: int = 100) -> Iterator[int]:
+        """
+        Постраничный обход order_ids по state.
+        """
+        for _, ids in self.iter_supply_order_pages(state=state, limit=limit):
+            yield from ids
 
     # ----------------------------
     # Order details
@@ -90,3 +102,22 @@ class OzonFboClient:
         Возвращает товары (offer_id, quantity) внутри Ozon bundle_id.
         """
         return self.post("/v1/supply-order/bundle", {"bundle_ids": bundle_ids, "limit": int(limit)})
+
+    # ----------------------------
+    # Typed
+    # ----------------------------
+    def fetch_supply_orders(self, order_ids: List[int]) -> List[SupplyOrder]:
+        """
+        Детали заявок, разобранные в SupplyOrder.
+        Если Ozon не отдал id в деталях, а количество совпадает — сопоставляем по порядку запроса.
+        """
+        raw = self.get_supply_orders(order_ids).get("orders") or []
+        orders = [SupplyOrder.from_ozon(o) for o in raw]
+        if len(orders) == len(order_ids) and all(o.order_id is None for o in orders):
+            for oid, o in zip(order_ids, orders):
+                o.order_id = int(oid)
+        return orders
+
+    def fetch_bundle_items(self, bundle_id: str, limit: int = 100) -> List[BundleItem]:
+        items = self.get_bundle_items([bundle_id], limit=limit).get("items") or []
+        return [bi for bi in (BundleItem.from_ozon(it) for it in items) if bi is not None]
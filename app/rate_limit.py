@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator
+
+# кабинет без запросов дольше этого — простаивает: его счётчик не даёт приоритета
+IDLE_S = 5.0
+
+# кабинет, от имени которого сейчас идут запросы (выставляет воркер синка)
+current_tenant: ContextVar[str] = ContextVar("current_tenant", default="")
+
+
+@contextmanager
+def tenant(name: str) -> Iterator[None]:
+    token = current_tenant.set(name)
+    try:
+        yield
+    finally:
+        current_tenant.reset(token)
+
+
+class FairRateBudget:
+    """
+    Общий бюджет запросов (token bucket) на несколько кабинетов.
+
+    Когда токенов не хватает на всех, следующий токен получает ожидающий кабинет,
+    которому выдано меньше всех — один шумный кабинет не выедает лимит МС у остальных.
+    Новый или простаивавший (IDLE_S) кабинет начинает со счётчиком не ниже
+    минимального среди активных: накопленный за простой «долг» не даёт ему
+    монопольного приоритета, пока он догоняет остальных.
+    """
+
+    def __init__(self, rate_per_s: float, burst: int = 1, idle_s: float = IDLE_S) -> None:
+        self.rate_per_s = max(float(rate_per_s), 0.001)
+        self.burst = max(int(burst), 1)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._cond = threading.Condition()
+        self._served: Dict[str, int] = {}
+        self._waiting: Dict[str, int] = {}
+        self._last_seen: Dict[str, float] = {}
+        self.idle_s = float(idle_s)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(float(self.burst), self._tokens + (now - self._last) * self.rate_per_s)
+        self._last = now
+
+    def _is_turn(self, name: str) -> bool:
+        waiting = [t for t, n in self._waiting.items() if n > 0]
+        low = min(self._served.get(t, 0) for t in waiting)
+        return self._served.get(name, 0) <= low
+
+    def _catch_up(self, name: str, now: float) -> None:
+        """Счётчик нового/простаивавшего кабинета — не ниже минимального среди активных."""
+        active = [
+            served for t, served in self._served.items()
+            if t != name and (self._waiting.get(t, 0) > 0 or now - self._last_seen.get(t, 0.0) <= self.idle_s)
+        ]
+        if active:
+            self._served[name] = max(self._served.get(name, 0), min(active))
+        else:
+            self._served.setdefault(name, 0)
+
+    def acquire(self, name: str = "") -> None:
+        name = name or current_tenant.get()
+        with self._cond:
+            now = time.monotonic()
+            if self._waiting.get(name, 0) == 0 and now - self._last_seen.get(name, float("-inf")) > self.idle_s:
+                self._catch_up(name, now)
+            self._waiting[name] = self._waiting.get(name, 0) + 1
+            try:
+                while True:
+                    self._refill()
+                    if self._tokens >= 1.0 and self._is_turn(name):
+                        self._tokens -= 1.0
+                        self._served[name] += 1
+                        return
+                    wait_s = (1.0 - self._tokens) / self.rate_per_s if self._tokens < 1.0 else 0.05
+                    self._cond.wait(timeout=max(wait_s, 0.005))
+            finally:
+                self._waiting[name] -= 1
+                self._last_seen[name] = time.monotonic()
+                self._cond.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        """Выдано токенов по кабинетам (после простоя счётчик подтянут, см. _catch_up)."""
+        with self._cond:
+            return dict(self._served)
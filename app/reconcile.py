@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+from .fbo_plan import MsSnapshot, positions_map
+
+# порядок сущностей в отчёте; количества move/demand сверяются с заказом
+RECONCILE_ENTITIES = ("customerorder", "move", "demand")
+
+
+@dataclass
+class ExpectedSupply:
+    """
+    Поставка Ozon, для которой синк должен был создать документы.
+    external_codes: entity -> externalCode обязательного документа.
+    quantities: assortment_id -> количество по данным Ozon (после разворачивания комплектов);
+    None — не считали (сверяются только документы МС между собой).
+    """
+    cabinet: str
+    order_id: int
+    order_number: str
+    state: int
+    external_codes: Dict[str, str]
+    quantities: Optional[Dict[str, float]] = None
+
+
+@dataclass
+class ReconcileIssue:
+    kind: str  # missing / orphaned / duplicated / quantity_mismatch
+    entity: str
+    external_code: str
+    cabinet: str = ""
+    order_id: Optional[int] = None
+    ids: List[str] = field(default_factory=list)
+    # quantity_mismatch: assortment_id -> [ожидалось, в документе]
+    diff: Dict[str, List[Optional[float]]] = field(default_factory=dict)
+
+    def as_log(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"action": f"reconcile_{self.kind}", "entity": self.entity, "externalCode": self.external_code}
+        if self.cabinet:
+            out["cabinet"] = self.cabinet
+        if self.order_id is not None:
+            out["order_id"] = self.order_id
+        if self.ids:
+            out["ids"] = self.ids
+        if self.diff:
+            out["diff"] = self.diff
+        return out
+
+
+@dataclass
+class ReconcileReport:
+    created_at: int = field(default_factory=lambda: int(time.time()))
+    supplies: int = 0
+    documents: int = 0
+    issues: List[ReconcileIssue] = field(default_factory=list)
+    # несчитанные чтения Ozon; непустой — отчёт неполный, orphaned не проверялись
+    incomplete: List[Dict[str, Any]] = field(default_factory=list)
+
+    def summary(self) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        for i in self.issues:
+            k = f"{i.entity}_{i.kind}"
+            out[k] = out.get(k, 0) + 1
+        return out
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "created_at": self.created_at, "supplies": self.supplies, "documents": self.documents,
+                    "complete": not self.incomplete, "incomplete": self.incomplete,
+                    "summary": self.summary(), "issues": [asdict(i) for i in self.issues],
+                },
+                f, ensure_ascii=False, indent=1,
+            )
+        os.replace(tmp, path)
+
+
+def _quantities(doc: Dict[str, Any]) -> Optional[Dict[str, float]]:
+    pm = positions_map(doc.get("positions"))
+    return None if pm is None else {aid: v[0] for aid, v in pm.items() if v[0]}
+
+
+def _qty_diff(expected: Dict[str, float], actual: Dict[str, float]) -> Dict[str, List[Optional[float]]]:
+    return {
+        aid: [expected.get(aid), actual.get(aid)]
+        for aid in sorted(set(expected) | set(actual))
+        if abs((expected.get(aid) or 0.0) - (actual.get(aid) or 0.0)) > 1e-9
+    }
+
+
+def reconcile(
+    snapshot: MsSnapshot,
+    expected: List[ExpectedSupply],
+    known_external_codes: Set[str],
+    incomplete: Optional[List[Dict[str, Any]]] = None,
+) -> ReconcileReport:
+    """
+    Сверка в памяти, без запросов:
+    - missing — у поставки нет обязательного документа;
+    - duplicated — несколько документов с одним externalCode;
+    - orphaned — документ синка, externalCode которого не принадлежит ни одной
+      поставке из списков Ozon (known_external_codes: все, включая вне фильтров синка);
+    - quantity_mismatch — количества документа расходятся с Ozon (если quantities
+      посчитаны) или, для move/demand, с заказом.
+    Для сравнения берётся последний по updated документ (как оставляет dedup).
+    incomplete — несчитанные чтения Ozon: known_external_codes неполон,
+    поэтому orphaned не проверяются (остальные проверки идут по считанным поставкам).
+    """
+    report = ReconcileReport(supplies=len(expected), incomplete=list(incomplete or []))
+    report.documents = sum(len(rows) for d in snapshot.docs.values() for rows in d.values())
+
+    for entity in RECONCILE_ENTITIES:
+        for ext, rows in sorted(snapshot.docs.get(entity, {}).items()):
+            ids = [str(r.get("id")) for r in rows]
+            if ext not in known_external_codes and not report.incomplete:
+                report.issues.append(ReconcileIssue("orphaned", entity, ext, ids=ids))
+            elif len(rows) > 1:
+                report.issues.append(ReconcileIssue("duplicated", entity, ext, ids=ids))
+
+    for sup in expected:
+        order_qty: Optional[Dict[str, float]] = None
+        for entity in RECONCILE_ENTITIES:
+            ext = sup.external_codes.get(entity)
+            if not ext:
+                continue
+            keep, _ = snapshot.pick(entity, ext)
+            if keep is None:
+                report.issues.append(ReconcileIssue("missing", entity, ext, cabinet=sup.cabinet, order_id=sup.order_id))
+                continue
+
+            actual = _quantities(keep)
+            if entity == "customerorder":
+                order_qty = actual
+            reference = sup.quantities if sup.quantities is not None else (order_qty if entity != "customerorder" else None)
+            if actual is None or reference is None:
+                continue
+            diff = _qty_diff(reference, actual)
+            if diff:
+                report.issues.append(ReconcileIssue(
+                    "quantity_mismatch", entity, ext, cabinet=sup.cabinet, order_id=sup.order_id,
+                    ids=[str(keep.get("id"))], diff=diff,
+                ))
+
+    return report
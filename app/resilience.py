@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Dict
+
+
+class CircuitBreaker:
+    """
+    Предохранитель на один апстрим (host).
+
+    После failure_threshold временных сбоев подряд (сеть, 5xx) размыкается
+    на cooldown_s: запросы к этому хосту сразу падают, без попыток и сна.
+    По истечении cooldown пропускается один пробный запрос (half-open):
+    успех или 429 (хост жив) замыкают цепь, сбой — снова размыкает.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, cooldown_s: float = 60.0) -> None:
+        self.name = name
+        self.failure_threshold = max(int(failure_threshold), 1)
+        self.cooldown_s = float(cooldown_s)
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown_s:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            # half-open: один пробный запрос за раз
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != self.CLOSED:
+                print({"action": "circuit_closed", "host": self.name})
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_neutral(self) -> None:
+        """
+        Хост ответил, но отказал по нашему лимиту (429): он жив, но и не «успех».
+        Закрытую цепь не трогает; пробный запрос half-open такой ответ
+        считает выжившим — цепь замыкается, повторы пробы не блокируются.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                print({"action": "circuit_closed", "host": self.name})
+                self.state = self.CLOSED
+                self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print({"action": "circuit_opened", "host": self.name, "failures": self.failures, "cooldown_s": self.cooldown_s})
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == self.OPEN
+
+    def retry_in_s(self) -> float:
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(self.cooldown_s - (time.monotonic() - self.opened_at), 0.0)
+
+
+class RetryBudget:
+    """
+    Общий на процесс бюджет повторов.
+
+    Каждый повтор тратит токен; каждый успешный запрос возвращает ratio токена
+    (не больше max_tokens). В норме повторов мало и бюджет полон; при массовых
+    сбоях он быстро кончается, и запросы падают с первой ошибки вместо
+    минут backoff на каждом вызове.
+    """
+
+    def __init__(self, max_tokens: float = 50.0, ratio: float = 0.2) -> None:
+        self.max_tokens = max(float(max_tokens), 0.0)
+        self.ratio = max(float(ratio), 0.0)
+        self.tokens = self.max_tokens
+        self._lock = threading.Lock()
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            return True
+
+    def deposit(self) -> None:
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"tokens": round(self.tokens, 2), "max_tokens": self.max_tokens}
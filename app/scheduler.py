@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from .models import SupplyOrder
+
+
+@dataclass(frozen=True)
+class WorkItem:
+    """
+    Одна поставка в очереди обработки.
+    order — разобранные детали из /v2/supply-order/get (загружены при сборе очереди).
+    """
+    cab_index: int
+    state: int
+    order_id: int
+    order: SupplyOrder = field(compare=False, repr=False)
+    timeslot: Optional[datetime] = None
+    retry: bool = False
+    # решено до раздачи по воркерам (см. _run_scheduled): чтения по поставке
+    # и проводить ли её перемещение (резерв остатков в порядке срочности)
+    prepared: Any = field(default=None, compare=False, repr=False)
+    apply_move: Optional[bool] = None
+
+
+@dataclass(frozen=True)
+class SchedulePolicy:
+    """
+    state_rank: ранг статуса, меньше — раньше
+        (переходы, которые создают move/demand, идут до холостых обновлений COMPLETED).
+    deadline_h: горизонт срочности по статусу в часах;
+        поставка с таймслотом ближе горизонта (или уже просроченным) обрабатывается первой.
+        0 — статус никогда не срочный.
+    """
+    state_rank: Dict[int, int]
+    deadline_h: Dict[int, float]
+
+    def key(self, item: WorkItem, now: datetime) -> Tuple[int, int, float, int, int]:
+        rank = self.state_rank.get(item.state, len(self.state_rank))
+        if item.timeslot is None:
+            return (1, rank, float("inf"), item.cab_index, item.order_id)
+
+        ts = item.timeslot if item.timeslot.tzinfo else item.timeslot.replace(tzinfo=timezone.utc)
+        until_s = (ts - now).total_seconds()
+        deadline_s = self.deadline_h.get(item.state, 0.0) * 3600.0
+        urgent = deadline_s > 0 and until_s <= deadline_s
+        return (0 if urgent else 1, rank, abs(until_s), item.cab_index, item.order_id)
+
+
+def order_work(items: List[WorkItem], policy: SchedulePolicy, now: Optional[datetime] = None) -> List[WorkItem]:
+    """
+    Порядок обработки по срочности поперёк всех кабинетов:
+    1) срочные (таймслот в пределах дедлайна статуса), 2) ранг статуса,
+    3) ближайший таймслот, 4) cabinet/order_id — для детерминированности.
+    """
+    now = now or datetime.now(timezone.utc)
+    return sorted(items, key=lambda it: policy.key(it, now))
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+# прогресс прогона сбрасывается на диск пачками: каждые FLUSH_EVERY изменений
+# или не реже FLUSH_INTERVAL_S; при падении повторно обработается не больше пачки
+FLUSH_EVERY = 50
+FLUSH_INTERVAL_S = 10.0
+
+
+def seen_path_for(state_path: str) -> str:
+    """Отпечатки daemon-режима лежат рядом с файлом состояния, отдельно от него."""
+    return state_path + ".seen"
+
+
+class FingerprintView:
+    """
+    Отпечатки одного кабинета (order_id -> fingerprint) с доступом под локом чекпоинта:
+    воркеры кабинетов пишут их параллельно с save().
+    """
+
+    def __init__(self, ckpt: "SyncCheckpoint", cab: str) -> None:
+        self._ckpt = ckpt
+        self._cab = cab
+
+    def _d(self) -> Dict[str, str]:
+        return self._ckpt.seen.setdefault(self._cab, {})
+
+    def get(self, key: str) -> Optional[str]:
+        with self._ckpt.lock:
+            return self._d().get(key)
+
+    def __setitem__(self, key: str, value: str) -> None:
+        with self._ckpt.lock:
+            self._d()[key] = value
+            self._ckpt._changed(seen=True)
+
+    def pop(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        with self._ckpt.lock:
+            d = self._d()
+            if key not in d:
+                return default
+            v = d.pop(key)
+            self._ckpt._changed(seen=True)
+            return v
+
+
+class SyncCheckpoint:
+    """
+    Состояние прогона синка в JSON-файле (FBO_STATE_FILE).
+
+    Хранит:
+    - run.done: "cab:state" -> order_id, уже обработанные в текущем прогоне
+    - retry: "cab" -> {order_id: {"state", "attempts", "error"}}
+    - seen: "cab" -> {order_id: отпечаток деталей поставки} (для daemon-режима)
+      — в отдельном файле seen_path_for(path), one-shot прогон его не переписывает.
+
+    Если прогон упал посередине — следующий запуск пропустит уже обработанные поставки.
+    Изменения копятся в памяти и пишутся пачками (FLUSH_EVERY / FLUSH_INTERVAL_S);
+    start_run/finish_run и flush() пишут сразу.
+    Методы потокобезопасны (кабинеты обрабатываются параллельно).
+    read_only — состояние читается, но файл не перезаписывается (построение плана).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        data: Optional[Dict[str, Any]] = None,
+        read_only: bool = False,
+        seen: Optional[Dict[str, Dict[str, str]]] = None,
+    ) -> None:
+        self.path = path
+        self.seen_path = seen_path_for(path)
+        self.read_only = read_only
+        self.lock = threading.RLock()
+        self.data: Dict[str, Any] = data or {}
+        self.data.setdefault("run", {})
+        self.data.setdefault("retry", {})
+        # старый формат: seen внутри файла состояния — переносим в отдельный файл
+        legacy_seen = self.data.pop("seen", None)
+        self.seen: Dict[str, Dict[str, str]] = seen if seen is not None else (legacy_seen or {})
+        # run.done в памяти — множества (в файле — списки)
+        self._done: Dict[str, Set[int]] = {
+            k: {int(x) for x in v} for k, v in (self._run.get("done") or {}).items()
+        }
+        self._pending = 0
+        self._seen_dirty = legacy_seen is not None
+        self._flushed_at = time.monotonic()
+
+    @property
+    def _run(self) -> Dict[str, Any]:
+        return self.data["run"]
+
+    @staticmethod
+    def _key(cab: str, state: int) -> str:
+        return f"{cab}:{state}"
+
+    # -------- run progress --------
+
+    @property
+    def resumed(self) -> bool:
+        return bool(self._run.get("started_at"))
+
+    def start_run(self) -> None:
+        with self.lock:
+            if not self._run.get("started_at"):
+                self._run["started_at"] = int(time.time())
+                self.save()
+
+    def finish_run(self) -> None:
+        with self.lock:
+            self.data["run"] = {}
+            self._done = {}
+            self.data["last_finished_at"] = int(time.time())
+            self.save()
+
+    def is_done(self, cab: str, state: int, order_id: int) -> bool:
+        with self.lock:
+            return int(order_id) in self._done.get(self._key(cab, state), ())
+
+    def mark_done(self, cab: str, state: int, order_id: int) -> None:
+        with self.lock:
+            self._done.setdefault(self._key(cab, state), set()).add(int(order_id))
+            self._changed()
+
+    # -------- retry queue --------
+
+    def retries(self, cab: str) -> List[Dict[str, Any]]:
+        with self.lock:
+            q = self.data["retry"].get(cab) or {}
+            return [dict(v, order_id=int(k)) for k, v in q.items()]
+
+    def add_retry(self, cab: str, order_id: int, state: int, error: str, count_attempt: bool = True) -> int:
+        """count_attempt=False — отложить без учёта попытки (временный сбой апстрима)."""
+        with self.lock:
+            q = self.data["retry"].setdefault(cab, {})
+            item = q.get(str(order_id)) or {"attempts": 0}
+            item["attempts"] = int(item.get("attempts", 0)) + (1 if count_attempt else 0)
+            item["state"] = int(state)
+            item["error"] = error[:300]
+            q[str(order_id)] = item
+            self._changed()
+            return item["attempts"]
+
+    def drop_retry(self, cab: str, order_id: int) -> None:
+        with self.lock:
+            q = self.data["retry"].get(cab) or {}
+            if q.pop(str(order_id), None) is not None:
+                self._changed()
+
+    # -------- change detection --------
+
+    def fingerprints(self, cab: str) -> FingerprintView:
+        """
+        Отпечатки кабинета: order_id (str) -> fingerprint.
+        Изменения попадают в файл при следующем сбросе пачки.
+        """
+        return FingerprintView(self, cab)
+
+    # -------- io --------
+
+    def _changed(self, seen: bool = False) -> None:
+        """Отметить изменение; файл пишется, когда накопилась пачка или истёк интервал."""
+        with self.lock:
+            self._pending += 1
+            if seen:
+                self._seen_dirty = True
+            if self._pending >= FLUSH_EVERY or time.monotonic() - self._flushed_at >= FLUSH_INTERVAL_S:
+                self.save()
+
+    def flush(self) -> None:
+        """Дописать накопленные изменения (конец прогона/тика, выход)."""
+        with self.lock:
+            if self._pending or self._seen_dirty:
+                self.save()
+
+    @staticmethod
+    def _write(path: str, data: Any) -> None:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def save(self) -> None:
+        if self.read_only:
+            return
+        with self.lock:
+            self._run["done"] = {k: sorted(v) for k, v in self._done.items()}
+            self._write(self.path, self.data)
+            if self._seen_dirty:
+                self._write(self.seen_path, self.seen)
+            self._pending = 0
+            self._seen_dirty = False
+            self._flushed_at = time.monotonic()
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        print({"action": "checkpoint_unreadable_start_fresh", "path": path})
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def load_checkpoint(path: str, read_only: bool = False) -> SyncCheckpoint:
+    return SyncCheckpoint(path, _read_json(path), read_only=read_only, seen=_read_json(seen_path_for(path)))
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, List, Optional
+
+from .moysklad import MoySkladClient
+
+
+def assortment_id_from_href(href: str) -> str:
+    # .../entity/product/<id>?expand=supplier -> <id>
+    return href.split("?", 1)[0].rstrip("/").rsplit("/", 1)[-1]
+
+
+def _position_needs(positions: List[Dict[str, Any]]) -> Dict[str, float]:
+    need: Dict[str, float] = {}
+    for p in positions:
+        href = (((p.get("assortment") or {}).get("meta") or {}).get("href")) or ""
+        if not href:
+            continue
+        aid = assortment_id_from_href(href)
+        need[aid] = need.get(aid, 0.0) + float(p.get("quantity") or 0)
+    return need
+
+
+class StockPlanner:
+    """
+    Предварительная проверка остатков для проведения перемещений.
+
+    Остатки склада-источника читаются один раз за прогон (/report/stock/bystore),
+    дальше перемещения резервируют их в порядке обработки (= порядок приоритета
+    из планировщика). Перемещение проводится, только если остатков хватает на все
+    его позиции — решение принимается до записи, без упавших PUT.
+    """
+
+    def __init__(self, ms: MoySkladClient, store_id: str, page_limit: int = 1000) -> None:
+        self.ms = ms
+        self.store_id = store_id
+        self.page_limit = page_limit
+        self.available: Optional[Dict[str, float]] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        store_href = self.ms.meta("store", self.store_id)["meta"]["href"]
+        available: Dict[str, float] = {}
+        rows = self.ms.iter_rows(
+            "/report/stock/bystore",
+            params={"filter": f"store={store_href}"},
+            fields=("stockByStore",),
+            page_limit=self.page_limit,
+        )
+        for r in rows:
+            href = ((r.get("meta") or {}).get("href")) or ""
+            if not href:
+                continue
+            stock = 0.0
+            for sb in r.get("stockByStore") or []:
+                sb_href = ((sb.get("meta") or {}).get("href")) or ""
+                if assortment_id_from_href(sb_href) == self.store_id:
+                    stock += float(sb.get("stock") or 0)
+            available[assortment_id_from_href(href)] = stock
+
+        self.available = available
+        print({"action": "stock_planner_loaded", "store_id": self.store_id, "assortments": len(available)})
+
+    def allocate(self, positions: List[Dict[str, Any]]) -> bool:
+        """
+        Всё или ничего: если остатков хватает на все позиции — списываем их
+        из доступных и возвращаем True, иначе ничего не трогаем и False.
+        """
+        need = _position_needs(positions)
+        with self._lock:
+            if self.available is None:
+                self.load()
+            assert self.available is not None
+
+            if not need:
+                return False
+            if any(self.available.get(aid, 0.0) < qty for aid, qty in need.items()):
+                return False
+            for aid, qty in need.items():
+                self.available[aid] = self.available.get(aid, 0.0) - qty
+            return True
+
+
+class StockPlannerPool:
+    """По одному StockPlanner на склад-источник (у кабинетов он может отличаться)."""
+
+    def __init__(self, ms: MoySkladClient) -> None:
+        self.ms = ms
+        self._planners: Dict[str, StockPlanner] = {}
+        self._lock = threading.Lock()
+
+    def for_store(self, store_id: str) -> StockPlanner:
+        with self._lock:
+            p = self._planners.get(store_id)
+            if p is None:
+                p = self._planners[store_id] = StockPlanner(self.ms, store_id)
+            return p
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List
+
+
+class WriteJournal:
+    """
+    Журнал намерений создания документов МС (FBO_JOURNAL_FILE).
+
+    Перед POST создания записывается "entity:externalCode" -> pending,
+    после ответа МС запись снимается. Запись, оставшаяся pending (таймаут,
+    падение процесса между POST и ответом), значит «мог создаться»:
+    следующая попытка сначала ищет документ по externalCode и только
+    если его нет — создаёт заново.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.RLock()
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    @staticmethod
+    def _key(entity: str, external_code: str) -> str:
+        return f"{entity}:{external_code}"
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        if isinstance(data, dict) and isinstance(data.get("pending"), dict):
+            self.pending = data["pending"]
+
+    def is_pending(self, entity: str, external_code: str) -> bool:
+        with self.lock:
+            return self._key(entity, external_code) in self.pending
+
+    def begin(self, entity: str, external_codes: Iterable[str]) -> None:
+        with self.lock:
+            now = int(time.time())
+            for ext in external_codes:
+                self.pending.setdefault(self._key(entity, ext), {"at": now})
+            self.save()
+
+    def resolve(self, entity: str, external_codes: Iterable[str]) -> None:
+        """Исход известен (создан или точно не создан) — намерение снимается."""
+        with self.lock:
+            changed = False
+            for ext in external_codes:
+                changed = self.pending.pop(self._key(entity, ext), None) is not None or changed
+            if changed:
+                self.save()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            keys: List[str] = sorted(self.pending)
+        return {"pending": len(keys), "oldest_at": min((self.pending[k].get("at") or 0 for k in keys), default=None)}
+
+    def save(self) -> None:
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"pending": self.pending}, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
@@ -1,27 +1,43 @@
 from __future__ import annotations
 
 import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
 from datetime import datetime, date
 from typing import Any, Dict, List, Optional, Tuple
 
-from app.config import load_config
+from app.config import OzonCabinet, load_config
 from app.ozon_fbo import OzonFboClient
-from app.moysklad import MoySkladClient
-
+from app.assortment_index import AssortmentIndex
+from app.fbo_plan import ORDER_LINK_KEY, MsSnapshot, PlanOp, SyncPlan, apply_plan, diff_doc, load_plan
+from app.http import RetryableHttpError, configure_resilience, resilience_stats
+from app.http_cache import ConditionalCache
+from app.moysklad import MoySkladClient, MsWriteResult
+from app.scheduler import SchedulePolicy, WorkItem, order_work
+from app.rate_limit import FairRateBudget, tenant
+from app.reconcile import ExpectedSupply, ReconcileReport, reconcile as reconcile_docs
+from app.state_store import FingerprintView, SyncCheckpoint, load_checkpoint
+from app.stock_planner import StockPlanner, StockPlannerPool, assortment_id_from_href
+from app.write_journal import WriteJournal
+
+from app.models import BundleItem, MsPosition, SupplyOrder, positions_payload
 from app.ms_customerorder import ensure_customerorder, find_customerorders_by_external
 from app.ms_move import (
     dedup_moves_by_external,
     create_move,
     update_move_positions_only,
+    create_move_applied,
+    update_move_positions_applied,
     build_move_positions_from_order_positions,
-    try_apply_move,
 )
 from app.ms_demand import (
     dedup_demands_by_external,
-    create_demand,
-    update_demand_positions_only,
+    create_demand_applied,
     build_demand_positions_from_order_positions,
-    try_apply_demand,
 )
 
 # =========================
@@ -49,6 +65,18 @@ DEMAND_OZON_STATES = {
     COMPLETED,
 }
 
+# детали поставок запрашиваем пачками (/v2/supply-order/get)
+DETAILS_BATCH = 50
+
+# поля заказа, которые сравниваются при планировании (их же пишет _order_payload)
+ORDER_DIFF_FIELDS = (
+    "name", "description", "deliveryPlannedMoment", "organization", "agent",
+    "state", "salesChannel", "store", "positions",
+)
+
+# планирование — один проход: справочные чтения МС кэшируются на весь прогон
+PLAN_CACHE_TTL_S = 24 * 3600
+
 # =========================
 # MOYSKLAD CONSTANTS (как ты задавал ранее)
 # =========================
@@ -64,10 +92,22 @@ MOVE_TARGET_STORE_ID = STORE_ID
 
 DEMAND_STATE_ID = "b543e330-44e4-11f0-0a80-0da5002260ab"
 
-SALES_CHANNEL_BY_CABINET = {
-    0: "fede2826-9fd0-11ee-0a80-0641000f3d25",
-    1: "ff2827b8-9fd0-11ee-0a80-0641000f3d31",
-}
+
+def _cab_ms_ids(cab: OzonCabinet) -> Dict[str, str]:
+    """
+    МС-реквизиты кабинета из реестра; не заданные — общие константы выше.
+    Канал продаж у каждого кабинета свой (ms_saleschannel_id).
+    """
+    store_id = cab.ms_store_id or STORE_ID
+    return {
+        "store": store_id,
+        "saleschannel": cab.ms_saleschannel_id,
+        "order_state": cab.ms_order_state_id or ORDER_STATE_ID,
+        "move_state": cab.ms_move_state_id or MOVE_STATE_ID,
+        "move_source_store": cab.ms_move_source_store_id or MOVE_SOURCE_STORE_ID,
+        "move_target_store": cab.ms_store_id or MOVE_TARGET_STORE_ID,
+        "demand_state": cab.ms_demand_state_id or DEMAND_STATE_ID,
+    }
 
 
 def _ext_order(order_number: str) -> str:
@@ -82,19 +122,6 @@ def _ext_demand(order_id: int) -> str:
     return f"OZON_FBO_DEMAND:{order_id}"
 
 
-def _parse_iso_dt(s: Optional[str]) -> Optional[datetime]:
-    if not s:
-        return None
-    s = s.strip()
-    # часто бывает Z
-    if s.endswith("Z"):
-        s = s[:-1] + "+00:00"
-    try:
-        return datetime.fromisoformat(s)
-    except Exception:
-        return None
-
-
 def _planned_from_date() -> date:
     """
     По ТЗ: с 03.12.25 включительно.
@@ -109,6 +136,24 @@ def _planned_from_date() -> date:
     return date(2025, 12, 3)
 
 
+def _poll_interval_s(state: int) -> int:
+    """
+    Интервал опроса списка поставок в daemon-режиме.
+    Горячие статусы — часто, COMPLETED — редко.
+    Переопределение: FBO_POLL_INTERVAL_S_<state>, FBO_POLL_HOT_S, FBO_POLL_COMPLETED_S.
+    """
+    v = os.getenv(f"FBO_POLL_INTERVAL_S_{state}", "").strip()
+    if not v:
+        if state == COMPLETED:
+            v = os.getenv("FBO_POLL_COMPLETED_S", "").strip() or "3600"
+        else:
+            v = os.getenv("FBO_POLL_HOT_S", "").strip() or "120"
+    try:
+        return max(int(v), 10)
+    except Exception:
+        return 120
+
+
 def _exclude_order_ids() -> set[int]:
     v = os.getenv("FBO_EXCLUDE_ORDER_IDS", "").strip()
     if not v:
@@ -125,335 +170,1059 @@ def _exclude_order_ids() -> set[int]:
     return out
 
 
-def _extract_timeslot_dt(order: Dict[str, Any]) -> Optional[datetime]:
+def _ozon_items_for_supply(oz: OzonFboClient, order: SupplyOrder) -> List[BundleItem]:
     """
-    Берём дату таймслота поставки.
-    В данных Ozon это обычно: order["supplies"][0]["timeslot"]["from"]
+    Возвращает товары (offer_id/article, qty) из Ozon bundle.
     """
-    supplies = order.get("supplies") or []
-    if not supplies:
-        return None
-    ts = (supplies[0].get("timeslot") or {})
-    return _parse_iso_dt(ts.get("from"))
-
-
-def _extract_warehouse_name(order: Dict[str, Any]) -> str:
-    supplies = order.get("supplies") or []
-    if not supplies:
-        return ""
-    wh = supplies[0].get("warehouse_name")
-    return str(wh) if wh else ""
-
-
-def _ozon_items_for_supply(oz: OzonFboClient, order: Dict[str, Any]) -> List[Tuple[str, float]]:
-    """
-    Возвращает список (offer_id/article, qty) из Ozon bundle.
-    """
-    supplies = order.get("supplies") or []
-    if not supplies:
-        return []
-    bundle_id = supplies[0].get("bundle_id")
-    if not bundle_id:
+    if not order.bundle_id:
         return []
-
-    b = oz.get_bundle_items([bundle_id], limit=100)
-    items = b.get("items") or []
-    out: List[Tuple[str, float]] = []
-    for it in items:
-        offer_id = it.get("offer_id")
-        qty = it.get("quantity")
-        if offer_id is None or qty is None:
-            continue
-        out.append((str(offer_id), float(qty)))
-    return out
+    return oz.fetch_bundle_items(order.bundle_id, limit=100)
 
 
-def _expand_to_ms_positions(ms: MoySkladClient, oz_items: List[Tuple[str, float]]) -> List[Dict[str, Any]]:
+def _expand_to_ms_positions(
+    ms: MoySkladClient,
+    oz_items: List[BundleItem],
+    with_prices: bool = True,
+    missing: Optional[List[str]] = None,
+) -> List[MsPosition]:
     """
     Для каждого offer_id:
     - ищем ассортимент по article
     - если product: берём его meta и salePrice
     - если bundle: берём компоненты и разворачиваем в product строки
+    Одинаковые товары (по href) склеиваются, quantity суммируется.
+    with_prices=False — без запросов цен (нужны только количества, сверка).
+    missing — сюда дописываются артикулы, которые не удалось развернуть (позиции неполные).
     """
-    out: List[Dict[str, Any]] = []
+    merged: Dict[str, MsPosition] = {}
+
+    def _add(meta: Dict[str, Any], href: str, qty: float) -> None:
+        p = merged.get(href)
+        if p is None:
+            merged[href] = MsPosition(meta, qty, int(ms.get_sale_price_by_href(href)) if with_prices else 0)
+        else:
+            # price оставляем как есть (в МС это обычно ок)
+            p.quantity += qty
 
-    for article, qty in oz_items:
-        ass = ms.find_assortment_by_article(article)
+    def _skip(action: str, article: str) -> None:
+        print({"action": action, "article": article})
+        if missing is not None:
+            missing.append(article)
+
+    for it in oz_items:
+        article, qty = it.offer_id, it.quantity
+        ass = ms.find_assortment(article)
         if not ass:
-            print({"action": "skip_article_not_found_in_ms", "article": article})
+            _skip("skip_article_not_found_in_ms", article)
             continue
 
-        atype = ((ass.get("meta") or {}).get("type")) or ass.get("type")
-        if atype == "bundle":
-            bundle_id = ass.get("id")
-            if not bundle_id:
-                print({"action": "skip_bundle_no_id", "article": article})
+        if ass.is_bundle:
+            if not ass.id:
+                _skip("skip_bundle_no_id", article)
                 continue
 
-            rows = ms.get_bundle_components(bundle_id)
-            if not rows:
-                print({"action": "skip_bundle_no_components", "article": article})
+            components = ms.get_bundle_component_positions(ass.id)
+            if not components:
+                _skip("skip_bundle_no_components", article)
                 continue
 
-            for r in rows:
-                meta = ((r.get("assortment") or {}).get("meta")) or {}
-                href = meta.get("href")
-                cqty = r.get("quantity")
-                if not href or not cqty:
-                    continue
-
-                prod = ms.get_by_href(href)
-                price = ms.get_sale_price(prod)
-
-                out.append(
-                    {
-                        "assortment": {"meta": meta},
-                        "quantity": float(qty) * float(cqty),
-                        "price": int(price),
-                    }
-                )
+            for c in components:
+                _add(c.meta, c.href, float(qty) * c.quantity)
         else:
-            meta = (ass.get("meta") or {})
-            href = meta.get("href")
+            href = ass.href
             if not href:
-                print({"action": "skip_assortment_no_href", "article": article})
+                _skip("skip_assortment_no_href", article)
                 continue
-            prod = ms.get_by_href(href)
-            price = ms.get_sale_price(prod)
-
-            out.append(
-                {
-                    "assortment": {"meta": meta},
-                    "quantity": float(qty),
-                    "price": int(price),
-                }
-            )
+            _add(ass.meta, href, float(qty))
 
-    # склеиваем одинаковые товары (по href), суммируем quantity
-    merged: Dict[str, Dict[str, Any]] = {}
-    for p in out:
-        href = (((p.get("assortment") or {}).get("meta") or {}).get("href")) or ""
-        if not href:
-            continue
-        if href not in merged:
-            merged[href] = p
+    return list(merged.values())
+
+
+def _new_stats() -> Dict[str, int]:
+    return {
+        "processed": 0,
+        "created_orders": 0,
+        "updated_orders": 0,
+        "skipped_cancelled": 0,
+        "skipped_excluded": 0,
+        "skipped_by_date": 0,
+        "skipped_no_positions": 0,
+        "skipped_unchanged": 0,
+        "failed": 0,
+        "deferred": 0,
+        "retried_ok": 0,
+    }
+
+
+def _supply_in_scope(order_id: int, o: SupplyOrder, state: int, planned_from: date, stats: Dict[str, int]) -> bool:
+    """Фильтры синка по деталям поставки: таймслот есть, не раньше planned_from, не отменена."""
+    # фильтр по таймслоту
+    ship_dt = o.timeslot
+    if ship_dt is None:
+        # без таймслота — пропускаем
+        print({"action": "skip_no_timeslot", "order_number": o.order_number or str(order_id), "order_id": order_id})
+        return False
+
+    if ship_dt.date() < planned_from:
+        stats["skipped_by_date"] += 1
+        return False
+
+    # если внезапно cancelled в деталях
+    if (o.state if o.state is not None else state) == CANCELLED:
+        stats["skipped_cancelled"] += 1
+        return False
+
+    return True
+
+
+def _prepare_order(
+    ms: MoySkladClient,
+    oz: OzonFboClient,
+    order_id: int,
+    o: SupplyOrder,
+    stats: Dict[str, int],
+    missing: Optional[List[str]] = None,
+) -> Optional[Tuple[str, str, str, List[MsPosition]]]:
+    """
+    Разворачивание поставки (уже прошедшей _supply_in_scope) в позиции МС.
+    Возвращает (order_number, description, deliveryPlannedMoment, позиции)
+    или None, если позиций нет (счётчик пропуска уже увеличен).
+    missing — см. _expand_to_ms_positions.
+    """
+    order_number = o.order_number or str(order_id)
+    wh_name = o.warehouse_name
+    ship_dt = o.timeslot
+    assert ship_dt is not None
+
+    comment = f"{order_number} - {wh_name}".strip(" -")
+    delivery_planned = ship_dt.strftime("%Y-%m-%d %H:%M:%S.000")
+
+    oz_items = _ozon_items_for_supply(oz, o)
+    ms_positions = _expand_to_ms_positions(ms, oz_items, missing=missing)
+
+    if not ms_positions:
+        print({"action": "skip_no_positions_after_expand", "order_number": order_number, "order_id": order_id})
+        stats["skipped_no_positions"] += 1
+        return None
+
+    return order_number, comment, delivery_planned, ms_positions
+
+
+@dataclass(frozen=True)
+class PreparedSupply:
+    """
+    Чтения по поставке, сделанные до записей (см. _prepare_supply).
+    in_scope=False — поставка отфильтрована; prep=None — позиций нет.
+    move — существующее перемещение (после dedup) или None.
+    """
+    in_scope: bool
+    prep: Optional[Tuple[str, str, str, List[MsPosition]]] = None
+    missing: Tuple[str, ...] = ()
+    move: Optional[Dict[str, Any]] = None
+
+
+def _prepare_supply(
+    ms: MoySkladClient,
+    oz: OzonFboClient,
+    order_id: int,
+    o: SupplyOrder,
+    state: int,
+    planned_from: date,
+    dry_run: bool,
+    stats: Dict[str, int],
+) -> PreparedSupply:
+    """Фильтры, позиции МС и текущее перемещение поставки — всё, что нужно до решения о проведении."""
+    if not _supply_in_scope(order_id, o, state, planned_from, stats):
+        return PreparedSupply(False)
+    missing: List[str] = []
+    prep = _prepare_order(ms, oz, order_id, o, stats, missing)
+    if prep is None:
+        return PreparedSupply(True, missing=tuple(missing))
+    # 1 заказ = 1 перемещение, dedup по external
+    keep_mv = dedup_moves_by_external(ms, _ext_move(order_id), dry_run=dry_run)
+    return PreparedSupply(True, prep, tuple(missing), keep_mv)
+
+
+def _order_payload(
+    ms: MoySkladClient,
+    ids: Dict[str, str],
+    order_number: str,
+    comment: str,
+    delivery_planned: str,
+    ms_positions: List[MsPosition],
+) -> Dict[str, Any]:
+    return {
+        "name": order_number,
+        "externalCode": _ext_order(order_number),
+        "organization": ms.meta("organization", ORGANIZATION_ID),
+        "agent": ms.meta("counterparty", AGENT_ID),
+        "state": ms.meta("state", ids["order_state"]),
+        "salesChannel": ms.meta("saleschannel", ids["saleschannel"]),
+        "description": comment,
+        "store": ms.meta("store", ids["store"]),
+        "deliveryPlannedMoment": delivery_planned,
+        "positions": positions_payload(ms_positions),
+    }
+
+
+def _move_payload(
+    ms: MoySkladClient,
+    ids: Dict[str, str],
+    order_number: str,
+    order_id: int,
+    comment: str,
+    order_ref: Dict[str, Any],
+    move_positions: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    return {
+        "name": order_number,
+        "externalCode": _ext_move(order_id),
+        "organization": ms.meta("organization", ORGANIZATION_ID),
+        "state": ms.meta("state", ids["move_state"]),
+        "sourceStore": ms.meta("store", ids["move_source_store"]),
+        "targetStore": ms.meta("store", ids["move_target_store"]),
+        "description": comment,
+        "customerOrder": order_ref,
+        "positions": move_positions,
+        # applicable выставляет create_move_applied: проведённым, если хватает остатков
+    }
+
+
+def _demand_payload(
+    ms: MoySkladClient,
+    ids: Dict[str, str],
+    order_number: str,
+    order_id: int,
+    comment: str,
+    order_ref: Dict[str, Any],
+    demand_positions: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    return {
+        "name": order_number,
+        "externalCode": _ext_demand(order_id),
+        "organization": ms.meta("organization", ORGANIZATION_ID),
+        "agent": ms.meta("counterparty", AGENT_ID),
+        "store": ms.meta("store", ids["store"]),
+        "state": ms.meta("state", ids["demand_state"]),
+        "description": comment,
+        "customerOrder": order_ref,
+        "positions": demand_positions,
+    }
+
+
+def _sync_order(
+    ms: MoySkladClient,
+    oz: OzonFboClient,
+    order_id: int,
+    o: SupplyOrder,
+    state: int,
+    cab: OzonCabinet,
+    planned_from: date,
+    dry_run: bool,
+    stats: Dict[str, int],
+    fingerprints: Optional[FingerprintView] = None,
+    prepared: Optional[PreparedSupply] = None,
+    apply_move: Optional[bool] = None,
+) -> bool:
+    """
+    Полный цикл по одной поставке: customerorder -> move -> demand.
+    o — детали поставки (загружаются пачкой при сборе очереди).
+    Исключения наружу пробрасываются — изоляция ошибок делается в _sync_item().
+    fingerprints — если задан, неизменившиеся поставки пропускаются (daemon-режим).
+    prepared — чтения, уже сделанные до раздачи по воркерам (иначе читаем здесь).
+    apply_move — решение планировщика остатков (см. _run_scheduled); None — пробовать провести.
+    Возвращает True, если поставка обработана полностью (или отфильтрована):
+    при тех же деталях повторять нечего. False — документы не созданы или
+    позиции неполные (товара ещё нет в МС), поставку стоит повторить.
+    """
+    if fingerprints is not None and fingerprints.get(str(order_id)) == o.fingerprint:
+        stats["skipped_unchanged"] += 1
+        return True
+
+    if prepared is None:
+        prepared = _prepare_supply(ms, oz, order_id, o, state, planned_from, dry_run, stats)
+    if not prepared.in_scope:
+        return True
+    if prepared.prep is None:
+        return False
+    order_number, comment, delivery_planned, ms_positions = prepared.prep
+
+    # externalCode для заказа
+    ext_order = _ext_order(order_number)
+    ids = _cab_ms_ids(cab)
+
+    # 1) customerorder dedup + create/update
+    payload_order = _order_payload(ms, ids, order_number, comment, delivery_planned, ms_positions)
+
+    # правило: если уже есть demand — заказ НЕ обновляем
+    ext_dem = _ext_demand(order_id)
+    existing_dem = dedup_demands_by_external(ms, ext_dem, dry_run=dry_run)
+    if existing_dem:
+        # но заказ должен существовать (если руками удаляли — восстановим)
+        rows = find_customerorders_by_external(ms, ext_order)
+        if not rows:
+            order_res = ensure_customerorder(ms, payload_order, dry_run=dry_run)
+            print(order_res.as_log())
+            if order_res.action == "created":
+                stats["created_orders"] += 1
         else:
-            merged[href]["quantity"] = float(merged[href].get("quantity", 0)) + float(p.get("quantity", 0))
-            # price оставляем как есть (в МС это обычно ок)
+            order_res = MsWriteResult.from_doc("exists", "customerorder", rows[-1], name=order_number, external_code=ext_order)
+            print({"action": "skip_order_update_because_demand_exists", "order_number": order_number, "demand_id": existing_dem.get("id")})
+    else:
+        order_res = ensure_customerorder(ms, payload_order, dry_run=dry_run)
+        print(order_res.as_log())
+        if order_res.action == "created":
+            stats["created_orders"] += 1
+        if order_res.action == "updated":
+            stats["updated_orders"] += 1
+
+    # id/meta заказа берём из ответа записи (нужно для связи move/demand)
+    order_ref = order_res.ref()
+    if not order_res.id or not order_ref:
+        # в dry_run заказа может ещё не быть — тогда пропускаем создание связанных документов
+        if dry_run:
+            stats["processed"] += 1
+            return False
+        # иначе это ошибка данных
+        print({"action": "error_order_missing_id", "order_number": order_number, "externalCode": ext_order})
+        return False
+
+    # 2) MOVE: 1 заказ = 1 перемещение (найдено и очищено от дублей в _prepare_supply)
+    ext_mv = _ext_move(order_id)
+    keep_mv = prepared.move
+
+    move_positions = build_move_positions_from_order_positions(ms_positions)
+
+    payload_move = _move_payload(ms, ids, order_number, order_id, comment, order_ref, move_positions)
+
+    # проводить ли — решено заранее, последовательно в порядке срочности;
+    # уже проведённое перемещение не планируется (apply_move=None),
+    # update_move_positions_applied сам откатится на непроведённое при нехватке
+    planned_apply = apply_move
+
+    if dry_run:
+        print({"action": "dry_run_move_create" if not keep_mv else "dry_run_move_update", "externalCode": ext_mv, "positions": len(move_positions), "apply": planned_apply})
+    else:
+        if planned_apply is False:
+            # остатков не хватает — сразу пишем непроведённым, без попытки проведения
+            if keep_mv:
+                mv = update_move_positions_only(ms, keep_mv["id"], move_positions)
+            else:
+                mv = create_move(ms, dict(payload_move, applicable=False))
+        elif keep_mv:
+            mv = update_move_positions_applied(ms, keep_mv["id"], move_positions)
+        else:
+            mv = create_move_applied(ms, payload_move)
+        print(dict(mv.as_log(), name=order_number))
+
+    # 3) DEMAND: только для нужных статусов (3/4/5/8)
+    if state in DEMAND_OZON_STATES:
+        demand_positions = build_demand_positions_from_order_positions(ms_positions)
+
+        payload_dem = _demand_payload(ms, ids, order_number, order_id, comment, order_ref, demand_positions)
+
+        # dedup по этому externalCode уже сделан выше — повторно не запрашиваем
+        keep_dem = existing_dem
+
+        if dry_run:
+            print({"action": "dry_run_demand_create" if not keep_dem else "dry_run_demand_exists", "externalCode": ext_dem, "positions": len(demand_positions)})
+        else:
+            if keep_dem:
+                # если отгрузка уже есть — НЕ обновляем (как требование)
+                print({"action": "skip_demand_exists", "id": keep_dem.get("id"), "externalCode": ext_dem})
+            else:
+                dem = create_demand_applied(ms, payload_dem)
+                print(dem.as_log())
+
+    stats["processed"] += 1
+    return not prepared.missing
+
+
+def _plan_order(
+    ms: MoySkladClient,
+    oz: OzonFboClient,
+    snapshot: MsSnapshot,
+    sync_plan: SyncPlan,
+    cab: OzonCabinet,
+    item: WorkItem,
+    planned_from: date,
+    stats: Dict[str, int],
+    planner: Optional[StockPlanner] = None,
+) -> None:
+    """
+    То же, что _sync_order, но без записей в МС: документы берутся из снимка,
+    в план попадают только реальные изменения (с пополевым diff).
+    Правила те же: при существующей отгрузке заказ не обновляется, отгрузка не меняется,
+    дубли по externalCode удаляются.
+    """
+    order_id, state = item.order_id, item.state
+    if not _supply_in_scope(order_id, item.order, state, planned_from, stats):
+        return
+    prep = _prepare_order(ms, oz, order_id, item.order, stats)
+    if prep is None:
+        return
+    order_number, comment, delivery_planned, ms_positions = prep
+
+    ids = _cab_ms_ids(cab)
+    ext_order, ext_mv, ext_dem = _ext_order(order_number), _ext_move(order_id), _ext_demand(order_id)
+
+    def _op(op: str, entity: str, ext: str, **kw: Any) -> None:
+        sync_plan.add(PlanOp(op=op, entity=entity, external_code=ext, cabinet=cab.name, order_id=order_id, **kw))
+
+    picked: Dict[str, Optional[Dict[str, Any]]] = {}
+    for entity, ext in (("customerorder", ext_order), ("move", ext_mv), ("demand", ext_dem)):
+        keep, dups = snapshot.pick(entity, ext)
+        picked[entity] = keep
+        for d in dups:
+            _op("delete", entity, ext, id=d.get("id"))
+
+    # 1) customerorder
+    payload_order = _order_payload(ms, ids, order_number, comment, delivery_planned, ms_positions)
+    keep_order, keep_dem = picked["customerorder"], picked["demand"]
+    if keep_order is None:
+        _op("create", "customerorder", ext_order, payload=payload_order)
+        stats["created_orders"] += 1
+        order_ref: Dict[str, Any] = {ORDER_LINK_KEY: ext_order}
+    else:
+        order_ref = {"meta": keep_order["meta"]}
+        # правило: если уже есть demand — заказ НЕ обновляем
+        if not keep_dem:
+            diff = diff_doc(keep_order, payload_order, ORDER_DIFF_FIELDS)
+            if diff:
+                _op("update", "customerorder", ext_order, id=keep_order.get("id"), payload=payload_order, diff=diff)
+                stats["updated_orders"] += 1
+
+    # 2) MOVE
+    keep_mv = picked["move"]
+    move_positions = build_move_positions_from_order_positions(ms_positions)
+    if keep_mv is None:
+        apply = planner.allocate(move_positions) if planner is not None else None
+        payload_move = _move_payload(ms, ids, order_number, order_id, comment, order_ref, move_positions)
+        _op("create", "move", ext_mv, payload=payload_move, apply=apply)
+    else:
+        diff = diff_doc(keep_mv, {"positions": move_positions}, ("positions",))
+        # уже проведённое перемещение держит свои остатки само — его не планируем
+        apply = None
+        if planner is not None and not keep_mv.get("applicable"):
+            apply = planner.allocate(move_positions)
+        if diff:
+            _op("update", "move", ext_mv, id=keep_mv.get("id"), payload={"positions": move_positions}, diff=diff, apply=apply)
+        elif not keep_mv.get("applicable") and apply is not False:
+            _op("apply", "move", ext_mv, id=keep_mv.get("id"), apply=apply)
+
+    # 3) DEMAND: только для нужных статусов (3/4/5/8); существующую не трогаем
+    if state in DEMAND_OZON_STATES and keep_dem is None:
+        demand_positions = build_demand_positions_from_order_positions(ms_positions)
+        payload_dem = _demand_payload(ms, ids, order_number, order_id, comment, order_ref, demand_positions)
+        _op("create", "demand", ext_dem, payload=payload_dem)
+
+    stats["processed"] += 1
+
+
+def _schedule_policy() -> SchedulePolicy:
+    """
+    Порядок обработки: сначала статусы, которые создают move/demand, COMPLETED — в конце.
+    Горизонт срочности (часы до таймслота) переопределяется FBO_DEADLINE_HOURS_<state>.
+    """
+    default_deadline_h = {
+        READY_TO_SUPPLY: 48.0,
+        ACCEPTED_AT_SUPPLY_WAREHOUSE: 24.0,
+        IN_TRANSIT: 24.0,
+        ACCEPTANCE_AT_STORAGE_WAREHOUSE: 24.0,
+        COMPLETED: 0.0,
+    }
+    deadline_h: Dict[int, float] = {}
+    for state, default in default_deadline_h.items():
+        v = os.getenv(f"FBO_DEADLINE_HOURS_{state}", "").strip()
+        try:
+            deadline_h[state] = float(v) if v else default
+        except Exception:
+            deadline_h[state] = default
+
+    state_rank = {state: (1 if state == COMPLETED else 0) for state in SYNC_STATES}
+    return SchedulePolicy(state_rank=state_rank, deadline_h=deadline_h)
+
+
+def _queue_retry(
+    ckpt: SyncCheckpoint,
+    cab_name: str,
+    max_attempts: int,
+    order_id: int,
+    state: int,
+    error: BaseException,
+    stats: Dict[str, int],
+) -> None:
+    """
+    Упавшая поставка -> очередь ретраев.
+    Временный сбой апстрима (RetryableHttpError: сеть, 5xx, разомкнутый предохранитель)
+    — поставка просто откладывается до следующего прогона, попытка не засчитывается.
+    """
+    transient = isinstance(error, RetryableHttpError)
+    stats["deferred" if transient else "failed"] += 1
+    attempts = ckpt.add_retry(cab_name, order_id, state, str(error), count_attempt=not transient)
+    print({
+        "action": "order_deferred" if transient else "order_failed_queued_for_retry",
+        "cabinet": cab_name, "order_id": order_id, "state": state, "attempts": attempts, "error": str(error)[:300],
+    })
+    if attempts >= max_attempts:
+        ckpt.drop_retry(cab_name, order_id)
+        print({"action": "order_retry_limit_reached", "cabinet": cab_name, "order_id": order_id, "attempts": attempts})
+
+
+def _fetch_details(
+    ckpt: SyncCheckpoint,
+    cfg: Any,
+    oz: OzonFboClient,
+    cab_index: int,
+    cab_name: str,
+    pending: List[Tuple[int, int, bool]],
+    stats: Dict[str, int],
+    failures: Optional[List[Dict[str, Any]]] = None,
+) -> List[WorkItem]:
+    """
+    Детали поставок пачками по DETAILS_BATCH вместо запроса на каждую.
+    pending: (order_id, state, retry).
+    failures — если задан, несчитанные пачки пишутся сюда, а не в очередь ретраев (сверка).
+    """
+    out: List[WorkItem] = []
+    for i in range(0, len(pending), DETAILS_BATCH):
+        chunk = pending[i:i + DETAILS_BATCH]
+        try:
+            orders = oz.fetch_supply_orders([oid for oid, _, _ in chunk])
+        except Exception as e:
+            if failures is not None:
+                print({"action": "fetch_supply_details_failed", "cabinet": cab_name, "orders": len(chunk), "error": str(e)[:300]})
+                failures.append({"cabinet": cab_name, "read": "details", "states": sorted({st for _, st, _ in chunk}), "order_ids": [oid for oid, _, _ in chunk]})
+                continue
+            for oid, state, _ in chunk:
+                _queue_retry(ckpt, cab_name, cfg.fbo_retry_max_attempts, oid, state, e, stats)
+            continue
+
+        by_id = {o.order_id: o for o in orders if o.order_id is not None}
+        for oid, state, retry in chunk:
+            o = by_id.get(oid)
+            if o is None:
+                if retry:
+                    ckpt.drop_retry(cab_name, oid)
+                continue
+            out.append(WorkItem(cab_index, state, oid, o, o.timeslot, retry))
+    return out
 
-    return list(merged.values())
+
+def _collect_work(
+    ckpt: SyncCheckpoint,
+    cfg: Any,
+    oz: OzonFboClient,
+    cab_index: int,
+    cab_name: str,
+    states: List[int],
+    excluded: set[int],
+    stats: Dict[str, int],
+    resumable: bool = True,
+    failures: Optional[List[Dict[str, Any]]] = None,
+) -> List[WorkItem]:
+    """
+    Собирает очередь кабинета: ретраи прошлых прогонов + списки поставок по статусам.
+    resumable=True — поставки, уже обработанные в прерванном прогоне, пропускаются.
+    failures — если задан, сюда пишется каждое несчитанное чтение Ozon (страница списка,
+    пачка деталей): сверке нужно знать, что списки неполные.
+    """
+    pending: List[Tuple[int, int, bool]] = []
+    # order_id -> индекс в pending
+    queued: Dict[int, int] = {}
+
+    # сначала — поставки, упавшие в прошлых прогонах
+    for item in ckpt.retries(cab_name):
+        order_id = item["order_id"]
+        if order_id in excluded:
+            ckpt.drop_retry(cab_name, order_id)
+            continue
+        queued[order_id] = len(pending)
+        pending.append((order_id, int(item.get("state") or READY_TO_SUPPLY), True))
+
+    for state in states:
+        # отменённые не трогаем вообще (на всякий)
+        if state == CANCELLED:
+            continue
+        try:
+            for _, ids in oz.iter_supply_order_pages(state=state, limit=100):
+                for order_id in ids:
+                    if order_id in queued:
+                        # ретрай с сохранённым при сбое статусом — берём текущий из списка
+                        # (упала в READY_TO_SUPPLY, теперь IN_TRANSIT — нужна и отгрузка)
+                        i = queued[order_id]
+                        pending[i] = (order_id, state, pending[i][2])
+                        continue
+                    if resumable and ckpt.is_done(cab_name, state, order_id):
+                        continue
+                    if order_id in excluded:
+                        print({"action": "skip_excluded_order", "order_id": order_id})
+                        stats["skipped_excluded"] += 1
+                        continue
+                    queued[order_id] = len(pending)
+                    pending.append((order_id, state, False))
+        except Exception as e:
+            # список не дочитали — остальное подберём следующим прогоном
+            print({"action": "list_supply_orders_failed", "cabinet": cab_name, "state": state, "error": str(e)[:300]})
+            if failures is not None:
+                failures.append({"cabinet": cab_name, "read": "list", "states": [state]})
+
+    return _fetch_details(ckpt, cfg, oz, cab_index, cab_name, pending, stats, failures)
+
+
+def _sync_item(
+    ckpt: SyncCheckpoint,
+    cfg: Any,
+    ms: MoySkladClient,
+    oz: OzonFboClient,
+    cab: OzonCabinet,
+    item: WorkItem,
+    planned_from: date,
+    dry_run: bool,
+    stats: Dict[str, int],
+    resumable: bool = True,
+    skip_unchanged: bool = False,
+) -> bool:
+    """
+    Обработка одной поставки с изоляцией ошибок:
+    упавшая поставка уходит в очередь ретраев, прогон продолжается.
+    """
+    order_id = item.order_id
+    cab_name = cab.name
+    if item.retry:
+        print({"action": "retry_failed_order", "cabinet": cab_name, "order_id": order_id})
+
+    fingerprints = ckpt.fingerprints(cab_name) if skip_unchanged else None
+    try:
+        complete = _sync_order(
+            ms, oz, order_id, item.order, item.state, cab, planned_from, dry_run, stats,
+            fingerprints, item.prepared, item.apply_move,
+        )
+    except Exception as e:
+        if fingerprints is not None:
+            fingerprints.pop(str(order_id), None)
+        _queue_retry(ckpt, cab_name, cfg.fbo_retry_max_attempts, order_id, item.state, e, stats)
+        ok = False
+    else:
+        ckpt.drop_retry(cab_name, order_id)
+        if item.retry:
+            stats["retried_ok"] += 1
+        if fingerprints is not None and not dry_run:
+            # отпечаток — только после полной обработки: неполную поставку
+            # (нет позиций, товара ещё нет в МС) daemon повторит на следующем опросе
+            if complete:
+                fingerprints[str(order_id)] = item.order.fingerprint
+            else:
+                fingerprints.pop(str(order_id), None)
+        ok = True
+
+    if resumable:
+        ckpt.mark_done(cab_name, item.state, order_id)
+    return ok
+
+
+def _run_scheduled(
+    ckpt: SyncCheckpoint,
+    cfg: Any,
+    ms: MoySkladClient,
+    cabinets: List[Tuple[OzonCabinet, OzonFboClient]],
+    items: List[WorkItem],
+    planned_from: date,
+    dry_run: bool,
+    stats: Dict[str, int],
+    resumable: bool = True,
+    skip_unchanged: bool = False,
+) -> None:
+    """
+    Очередь в порядке срочности раздаётся по пулам кабинетов
+    (cab.concurrency воркеров на кабинет); запросы к МС всех кабинетов
+    делят один бюджет ms.rate_budget поровну.
+
+    С FBO_STOCK_PREFLIGHT — в три шага: чтения по поставкам (в пулах),
+    резерв остатков склада-источника одним последовательным проходом в порядке
+    срочности поперёк кабинетов (как в _build_plan), затем записи (в пулах).
+    Решение о проведении едет в WorkItem.apply_move и от потоков не зависит.
+    """
+    ordered = order_work(items, _schedule_policy())
+    stats_lock = threading.Lock()
+
+    def _merge(local: Dict[str, int]) -> None:
+        with stats_lock:
+            for k, v in local.items():
+                stats[k] += v
+
+    def _prepare(item: WorkItem) -> WorkItem:
+        cab, oz = cabinets[item.cab_index]
+        if skip_unchanged and ckpt.fingerprints(cab.name).get(str(item.order_id)) == item.order.fingerprint:
+            return item
+        local = _new_stats()
+        try:
+            with tenant(cab.name):
+                prepared = _prepare_supply(ms, oz, item.order_id, item.order, item.state, planned_from, dry_run, local)
+        except Exception as e:
+            # чтение повторится при записи и уйдёт в очередь ретраев; без резерва — не проводим
+            print({"action": "prepare_supply_failed", "cabinet": cab.name, "order_id": item.order_id, "error": str(e)[:300]})
+            return replace(item, apply_move=False)
+        finally:
+            _merge(local)
+        return replace(item, prepared=prepared)
+
+    def _task(item: WorkItem) -> None:
+        cab, oz = cabinets[item.cab_index]
+        local = _new_stats()
+        with tenant(cab.name):
+            _sync_item(
+                ckpt, cfg, ms, oz, cab, item, planned_from, dry_run, local,
+                resumable=resumable, skip_unchanged=skip_unchanged,
+            )
+        _merge(local)
+
+    pools = {
+        cab_index: ThreadPoolExecutor(max_workers=cab.concurrency, thread_name_prefix=cab.name)
+        for cab_index, (cab, _) in enumerate(cabinets)
+    }
+    try:
+        if cfg.fbo_stock_preflight and ordered:
+            ordered = [f.result() for f in [pools[item.cab_index].submit(_prepare, item) for item in ordered]]
+            ordered = _allocate_moves(ms, cabinets, ordered)
+        futures = [pools[item.cab_index].submit(_task, item) for item in ordered]
+        for f in futures:
+            f.result()
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True)
+        # прогресс пишется пачками — хвост дописываем и при падении
+        ckpt.flush()
+
+
+def _allocate_moves(
+    ms: MoySkladClient,
+    cabinets: List[Tuple[OzonCabinet, OzonFboClient]],
+    ordered: List[WorkItem],
+) -> List[WorkItem]:
+    """
+    Резерв остатков под перемещения: один проход в порядке ordered (срочность поперёк
+    кабинетов), остатки каждого склада-источника читаются один раз за прогон.
+    Уже проведённые перемещения держат остатки сами — их не планируем.
+    Остатки склада не прочитались — его перемещения идут без резерва (apply_move=None:
+    МС сам решит, create/update_applied откатятся на непроведённое), записи не встают.
+    """
+    planners = StockPlannerPool(ms)
+    unavailable: set[str] = set()
+    out: List[WorkItem] = []
+    for item in ordered:
+        p = item.prepared
+        if p is not None and p.prep is not None and not (p.move and p.move.get("applicable")):
+            store_id = _cab_ms_ids(cabinets[item.cab_index][0])["move_source_store"]
+            if store_id not in unavailable:
+                try:
+                    apply = planners.for_store(store_id).allocate(build_move_positions_from_order_positions(p.prep[3]))
+                except Exception as e:
+                    unavailable.add(store_id)
+                    print({"action": "stock_planner_load_failed", "store_id": store_id, "error": str(e)[:300]})
+                else:
+                    item = replace(item, apply_move=apply)
+        out.append(item)
+    return out
+
+
+def _cabinets(cfg: Any) -> List[Tuple[OzonCabinet, OzonFboClient]]:
+    return [(cab, OzonFboClient(cab.client_id, cab.api_key)) for cab in cfg.cabinets]
+
+
+def _ms_client(cfg: Any, cache_ttl_s: int = 0) -> MoySkladClient:
+    """
+    Клиент МС с условными GET (ETag/Last-Modified в FBO_CACHE_DIR/http),
+    локальным снимком ассортимента (докачка по updated>=) и общим на все
+    кабинеты бюджетом запросов (FBO_MS_RATE_PER_S / FBO_MS_RATE_BURST).
+    Заодно настраивает предохранители HTTP (FBO_BREAKER_*, FBO_RETRY_BUDGET).
+    Создания документов идут через журнал намерений (FBO_JOURNAL_FILE) —
+    POST с неизвестным исходом не повторяется вслепую.
+    """
+    # предохранители хостов и общий бюджет повторов (Ozon и МС)
+    configure_resilience(cfg.fbo_breaker_failures, cfg.fbo_breaker_cooldown_s, cfg.fbo_retry_budget)
+    index = AssortmentIndex(os.path.join(cfg.fbo_cache_dir, "assortment.json")) if cfg.fbo_assortment_index else None
+    return MoySkladClient(
+        cfg.moysklad_token,
+        cache_ttl_s=cache_ttl_s,
+        rate_budget=FairRateBudget(cfg.ms_rate_per_s, cfg.ms_rate_burst),
+        http_cache=ConditionalCache(os.path.join(cfg.fbo_cache_dir, "http")),
+        assortment_index=index,
+        journal=WriteJournal(cfg.fbo_journal_file),
+    )
+
+
+def _refresh_assortment_index(ms: MoySkladClient) -> None:
+    if ms.assortment_index is None:
+        return
+    try:
+        ms.assortment_index.refresh(ms)
+    except Exception as e:
+        # без снимка просто работаем живым поиском по артикулу
+        print({"action": "assortment_index_refresh_failed", "error": str(e)[:300]})
+
+
+def _build_plan(cfg: Any, ms: MoySkladClient) -> Tuple[SyncPlan, Dict[str, int]]:
+    """
+    План записей по всем кабинетам. Из МС только чтения, и те пакетные:
+    снимок документов синка, снимок ассортимента, остатки склада-источника;
+    товары и комплекты — по одному разу за прогон (кэш клиента).
+    Чекпоинт читается (ретраи), но не пишется.
+    """
+    planned_from = _planned_from_date()
+    excluded = _exclude_order_ids()
+    ckpt = load_checkpoint(cfg.fbo_state_file, read_only=True)
+
+    stats = _new_stats()
+    cabinets = _cabinets(cfg)
+    items: List[WorkItem] = []
+    for cab_index, (cab, oz) in enumerate(cabinets):
+        items.extend(_collect_work(ckpt, cfg, oz, cab_index, cab.name, list(SYNC_STATES), excluded, stats, resumable=False))
+    print({"action": "work_collected", "items": len(items)})
+
+    sync_plan = SyncPlan()
+    if not items:
+        return sync_plan, stats
+
+    _refresh_assortment_index(ms)
+    snapshot = MsSnapshot.load(ms)
+    planners = StockPlannerPool(ms) if cfg.fbo_stock_preflight else None
+
+    # последовательно и в порядке срочности: резерв остатков детерминирован поперёк кабинетов
+    for item in order_work(items, _schedule_policy()):
+        cab, oz = cabinets[item.cab_index]
+        planner = planners.for_store(_cab_ms_ids(cab)["move_source_store"]) if planners else None
+        try:
+            _plan_order(ms, oz, snapshot, sync_plan, cab, item, planned_from, stats, planner)
+        except Exception as e:
+            stats["deferred" if isinstance(e, RetryableHttpError) else "failed"] += 1
+            print({"action": "plan_order_failed", "cabinet": cab.name, "order_id": item.order_id, "error": str(e)[:300]})
+    return sync_plan, stats
+
+
+def plan(path: Optional[str] = None) -> int:
+    """Строит план без записей в МС и сохраняет его (FBO_PLAN_FILE)."""
+    cfg = load_config()
+    # справочные чтения кэшируются на весь прогон планирования
+    ms = _ms_client(cfg, cache_ttl_s=PLAN_CACHE_TTL_S)
+    path = path or cfg.fbo_plan_file
+
+    sync_plan, stats = _build_plan(cfg, ms)
+    sync_plan.save(path)
+    print({"action": "plan_done", "path": path, "ops": len(sync_plan.ops), **sync_plan.summary(), **stats})
+    return stats["processed"]
+
+
+def apply_plan_file(path: Optional[str] = None) -> Dict[str, int]:
+    """Исполняет сохранённый план пакетами (см. app.fbo_plan.apply_plan)."""
+    cfg = load_config()
+    ms = _ms_client(cfg)
+    path = path or cfg.fbo_plan_file
+
+    sync_plan = load_plan(path)
+    print({"action": "apply_plan_started", "path": path, "ops": len(sync_plan.ops), "age_s": int(time.time()) - sync_plan.created_at})
+    stats = apply_plan(ms, sync_plan)
+    print({"action": "apply_plan_done", "path": path, **stats})
+    return stats
+
+
+def reconcile(out: Optional[str] = None) -> ReconcileReport:
+    """
+    Сверка поставок Ozon (SYNC_STATES) с документами МС без записей.
+    Чтения пакетные: списки и детали поставок, снимок документов синка (MsSnapshot).
+    Товары Ozon (bundle) читаются только для поставок, у которых заказ в МС есть, —
+    остальным нечего сверять по количествам.
+    Если хоть одно чтение списков/деталей Ozon не удалось, отчёт помечается
+    неполным и orphaned не ищутся: документы несчитанных поставок иначе
+    выглядели бы сиротами (у МС-документа нет кабинета, сузить проверку не к чему).
+    """
+    cfg = load_config()
+    ms = _ms_client(cfg, cache_ttl_s=PLAN_CACHE_TTL_S)
+    planned_from = _planned_from_date()
+    excluded = _exclude_order_ids()
+
+    # пустой чек-пойнт: без очереди ретраев, в файл ничего не пишется
+    ckpt = SyncCheckpoint(cfg.fbo_state_file, read_only=True)
+    stats = _new_stats()
+    cabinets = _cabinets(cfg)
+    items: List[WorkItem] = []
+    failures: List[Dict[str, Any]] = []
+    for cab_index, (cab, oz) in enumerate(cabinets):
+        # исключённые тоже собираем: их документы не должны попасть в orphaned
+        items.extend(_collect_work(ckpt, cfg, oz, cab_index, cab.name, list(SYNC_STATES), set(), stats, resumable=False, failures=failures))
+
+    snapshot = MsSnapshot.load(ms)
+    _refresh_assortment_index(ms)
+
+    expected: List[ExpectedSupply] = []
+    known: set[str] = set()
+    for item in items:
+        cab, oz = cabinets[item.cab_index]
+        o, order_id = item.order, item.order_id
+        exts = {
+            "customerorder": _ext_order(o.order_number or str(order_id)),
+            "move": _ext_move(order_id),
+            "demand": _ext_demand(order_id),
+        }
+        known.update(exts.values())
+        if order_id in excluded or not _supply_in_scope(order_id, o, item.state, planned_from, stats):
+            continue
+        if item.state not in DEMAND_OZON_STATES:
+            exts.pop("demand")
+
+        quantities: Optional[Dict[str, float]] = None
+        if snapshot.pick("customerorder", exts["customerorder"])[0] is not None:
+            try:
+                positions = _expand_to_ms_positions(ms, _ozon_items_for_supply(oz, o), with_prices=False)
+            except Exception as e:
+                print({"action": "reconcile_items_failed", "cabinet": cab.name, "order_id": order_id, "error": str(e)[:300]})
+            else:
+                quantities = {}
+                for p in positions:
+                    aid = assortment_id_from_href(p.href)
+                    quantities[aid] = quantities.get(aid, 0.0) + p.quantity
+        expected.append(ExpectedSupply(cab.name, order_id, o.order_number, item.state, exts, quantities))
+
+    report = reconcile_docs(snapshot, expected, known, incomplete=failures)
+    if report.incomplete:
+        print({"action": "reconcile_incomplete", "ozon_read_failures": len(report.incomplete), "orphans_checked": False})
+    for issue in report.issues:
+        print(issue.as_log())
+    if out:
+        report.save(out)
+    print({
+        "action": "reconcile_done", "supplies": report.supplies, "documents": report.documents,
+        "issues": len(report.issues), "complete": not report.incomplete, **report.summary(),
+    })
+    return report
 
 
 def sync() -> int:
     cfg = load_config()
-    ms = MoySkladClient(cfg.moysklad_token)
 
     dry_run = bool(cfg.fbo_dry_run) or os.getenv("FBO_DRY_RUN", "").strip() in ("1", "true", "yes", "on")
+    if dry_run:
+        # dry-run = план записей (FBO_PLAN_FILE) вместо поштучного прохода по МС
+        return plan()
+
+    ms = _ms_client(cfg)
     planned_from = _planned_from_date()
     excluded = _exclude_order_ids()
 
-    processed = 0
-    created_orders = 0
-    updated_orders = 0
-    skipped_cancelled = 0
-    skipped_excluded = 0
-    skipped_by_date = 0
-    skipped_no_positions = 0
-
-    for cab_index, cab in enumerate(cfg.cabinets):
-        oz = OzonFboClient(cab.client_id, cab.api_key)
-        sales_channel_id = SALES_CHANNEL_BY_CABINET.get(cab_index, SALES_CHANNEL_BY_CABINET[0])
-
-        for state in SYNC_STATES:
-            # отменённые не трогаем вообще (на всякий)
-            if state == CANCELLED:
-                continue
+    ckpt = load_checkpoint(cfg.fbo_state_file)
+    if ckpt.resumed:
+        print({"action": "resume_interrupted_run", "state_file": cfg.fbo_state_file})
+    ckpt.start_run()
 
-            for order_id in oz.iter_supply_order_ids(state=state, limit=100):
-                if order_id in excluded:
-                    print({"action": "skip_excluded_order", "order_id": order_id})
-                    skipped_excluded += 1
-                    continue
-
-                # детали поставки
-                detail = oz.get_supply_orders([order_id])
-                orders = detail.get("orders") or []
-                if not orders:
-                    continue
-                o = orders[0]
-
-                order_number = str(o.get("order_number") or order_id)
-                wh_name = _extract_warehouse_name(o)
-
-                # фильтр по таймслоту
-                ship_dt = _extract_timeslot_dt(o)
-                if ship_dt is None:
-                    # без таймслота — пропускаем
-                    print({"action": "skip_no_timeslot", "order_number": order_number, "order_id": order_id})
-                    continue
-
-                if ship_dt.date() < planned_from:
-                    skipped_by_date += 1
-                    continue
-
-                # если внезапно cancelled в деталях
-                if int(o.get("state", state)) == CANCELLED:
-                    skipped_cancelled += 1
-                    continue
-
-                comment = f"{order_number} - {wh_name}".strip(" -")
-                delivery_planned = ship_dt.strftime("%Y-%m-%d %H:%M:%S.000")
-
-                oz_items = _ozon_items_for_supply(oz, o)
-                ms_positions = _expand_to_ms_positions(ms, oz_items)
-
-                if not ms_positions:
-                    print({"action": "skip_no_positions_after_expand", "order_number": order_number, "order_id": order_id})
-                    skipped_no_positions += 1
-                    continue
-
-                # externalCode для заказа
-                ext_order = _ext_order(order_number)
-
-                # 1) customerorder dedup + create/update
-                payload_order: Dict[str, Any] = {
-                    "name": order_number,
-                    "externalCode": ext_order,
-                    "organization": ms.meta("organization", ORGANIZATION_ID),
-                    "agent": ms.meta("counterparty", AGENT_ID),
-                    "state": ms.meta("state", ORDER_STATE_ID),
-                    "salesChannel": ms.meta("saleschannel", sales_channel_id),
-                    "description": comment,
-                    "store": ms.meta("store", STORE_ID),
-                    "deliveryPlannedMoment": delivery_planned,
-                    "positions": ms_positions,
-                }
-
-                # правило: если уже есть demand — заказ НЕ обновляем
-                ext_dem = _ext_demand(order_id)
-                existing_dem = dedup_demands_by_external(ms, ext_dem, dry_run=dry_run)
-                if existing_dem:
-                    # но заказ должен существовать (если руками удаляли — восстановим)
-                    rows = find_customerorders_by_external(ms, ext_order)
-                    if not rows:
-                        r = ensure_customerorder(ms, payload_order, dry_run=dry_run)
-                        print(r)
-                        if r.get("action") == "created":
-                            created_orders += 1
-                    else:
-                        print({"action": "skip_order_update_because_demand_exists", "order_number": order_number, "demand_id": existing_dem.get("id")})
-                else:
-                    r = ensure_customerorder(ms, payload_order, dry_run=dry_run)
-                    print(r)
-                    if r.get("action") == "created":
-                        created_orders += 1
-                    if r.get("action") == "updated":
-                        updated_orders += 1
-
-                # получаем order id в МС (нужно для связи move/demand)
-                order_rows = find_customerorders_by_external(ms, ext_order)
-                if not order_rows:
-                    # в dry_run может быть пусто — тогда пропускаем создание связанных документов
-                    if dry_run:
-                        processed += 1
-                        continue
-                    # иначе это ошибка данных
-                    print({"action": "error_order_not_found_after_ensure", "order_number": order_number, "externalCode": ext_order})
-                    continue
-
-                order_ms = order_rows[-1]
-                order_ms_id = order_ms.get("id")
-                if not order_ms_id:
-                    if dry_run:
-                        processed += 1
-                        continue
-                    print({"action": "error_order_missing_id", "order_number": order_number})
-                    continue
-
-                # 2) MOVE: 1 заказ = 1 перемещение, dedup по external
-                ext_mv = _ext_move(order_id)
-                keep_mv = dedup_moves_by_external(ms, ext_mv, dry_run=dry_run)
-
-                move_positions = build_move_positions_from_order_positions(ms_positions)
-
-                payload_move: Dict[str, Any] = {
-                    "name": order_number,
-                    "externalCode": ext_mv,
-                    "organization": ms.meta("organization", ORGANIZATION_ID),
-                    "state": ms.meta("state", MOVE_STATE_ID),
-                    "sourceStore": ms.meta("store", MOVE_SOURCE_STORE_ID),
-                    "targetStore": ms.meta("store", MOVE_TARGET_STORE_ID),
-                    "description": comment,
-                    "customerOrder": ms.meta("customerorder", order_ms_id),
-                    "positions": move_positions,
-                    "applicable": False,  # создаём не проведённым
-                }
-
-                if dry_run:
-                    print({"action": "dry_run_move_create" if not keep_mv else "dry_run_move_update", "externalCode": ext_mv, "positions": len(move_positions)})
-                else:
-                    if keep_mv:
-                        update_move_positions_only(ms, keep_mv["id"], move_positions)
-                        move_id = keep_mv["id"]
-                        print({"action": "move_updated", "id": move_id, "name": order_number})
-                    else:
-                        mv = create_move(ms, payload_move)
-                        move_id = mv.get("id")
-                        print({"action": "move_created", "id": move_id, "name": order_number})
-
-                    if move_id:
-                        print(try_apply_move(ms, move_id))
-
-                # 3) DEMAND: только для нужных статусов (3/4/5/8)
-                if state in DEMAND_OZON_STATES:
-                    demand_positions = build_demand_positions_from_order_positions(ms_positions)
-
-                    payload_dem: Dict[str, Any] = {
-                        "name": order_number,
-                        "externalCode": ext_dem,
-                        "organization": ms.meta("organization", ORGANIZATION_ID),
-                        "agent": ms.meta("counterparty", AGENT_ID),
-                        "store": ms.meta("store", STORE_ID),
-                        "state": ms.meta("state", DEMAND_STATE_ID),
-                        "description": comment,
-                        "customerOrder": ms.meta("customerorder", order_ms_id),
-                        "positions": demand_positions,
-                        "applicable": False,
-                    }
-
-                    keep_dem = dedup_demands_by_external(ms, ext_dem, dry_run=dry_run)
-
-                    if dry_run:
-                        print({"action": "dry_run_demand_create" if not keep_dem else "dry_run_demand_exists", "externalCode": ext_dem, "positions": len(demand_positions)})
-                    else:
-                        if keep_dem:
-                            # если отгрузка уже есть — НЕ обновляем (как требование)
-                            print({"action": "skip_demand_exists", "id": keep_dem.get("id"), "externalCode": ext_dem})
-                        else:
-                            dem = create_demand(ms, payload_dem)
-                            demand_id = dem.get("id")
-                            print({"action": "demand_created", "id": demand_id, "name": order_number})
-                            if demand_id:
-                                print(try_apply_demand(ms, demand_id))
-
-                processed += 1
+    stats = _new_stats()
+    cabinets = _cabinets(cfg)
+
+    # 1) очередь поперёк всех кабинетов, 2) обработка по срочности
+    items: List[WorkItem] = []
+    for cab_index, (cab, oz) in enumerate(cabinets):
+        items.extend(_collect_work(ckpt, cfg, oz, cab_index, cab.name, list(SYNC_STATES), excluded, stats))
+    print({"action": "work_collected", "items": len(items)})
+
+    if items:
+        _refresh_assortment_index(ms)
+
+    _run_scheduled(ckpt, cfg, ms, cabinets, items, planned_from, dry_run, stats)
+
+    ckpt.finish_run()
 
     print(
         {
             "action": "sync_done",
             "dry_run": dry_run,
             "planned_from": planned_from.isoformat(),
-            "processed": processed,
-            "created_orders": created_orders,
-            "updated_orders": updated_orders,
-            "skipped_cancelled": skipped_cancelled,
-            "skipped_excluded": skipped_excluded,
-            "skipped_by_date": skipped_by_date,
-            "skipped_no_positions": skipped_no_positions,
+            **stats,
+            **resilience_stats(),
+            "ms_requests_by_cabinet": ms.rate_budget.stats() if ms.rate_budget is not None else {},
         }
     )
-    return processed
+    return stats["processed"]
+
+
+def daemon() -> None:
+    """
+    Долгоживущий режим: клиенты, пул соединений и кэши МС остаются тёплыми.
+    Каждый cabinet+state опрашивается со своим интервалом (_poll_interval_s),
+    обрабатываются только поставки, у которых изменились детали.
+    """
+    cfg = load_config()
+    ms = _ms_client(cfg, cache_ttl_s=cfg.fbo_cache_ttl_s)
+
+    dry_run = bool(cfg.fbo_dry_run) or os.getenv("FBO_DRY_RUN", "").strip() in ("1", "true", "yes", "on")
+    planned_from = _planned_from_date()
+    excluded = _exclude_order_ids()
+
+    ckpt = load_checkpoint(cfg.fbo_state_file)
+
+    cabinets = _cabinets(cfg)
+    next_due: Dict[Tuple[int, int], float] = {
+        (cab_index, state): 0.0
+        for cab_index in range(len(cabinets))
+        for state in SYNC_STATES
+        if state != CANCELLED
+    }
+
+    stopping = {"flag": False}
+
+    def _stop(signum: int, frame: Any) -> None:
+        print({"action": "daemon_stopping", "signal": signum})
+        stopping["flag"] = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    print({"action": "daemon_started", "dry_run": dry_run, "planned_from": planned_from.isoformat()})
+
+    while not stopping["flag"]:
+        stats = _new_stats()
+        now = time.monotonic()
+        due_keys = [k for k, due in next_due.items() if due <= now]
+
+        if due_keys:
+            items: List[WorkItem] = []
+            for cab_index in sorted({k[0] for k in due_keys}):
+                cab, oz = cabinets[cab_index]
+                states = [state for ci, state in due_keys if ci == cab_index]
+                items.extend(_collect_work(ckpt, cfg, oz, cab_index, cab.name, states, excluded, stats, resumable=False))
+
+            if items:
+                _refresh_assortment_index(ms)
+            try:
+                _run_scheduled(
+                    ckpt, cfg, ms, cabinets, items, planned_from, dry_run, stats,
+                    resumable=False, skip_unchanged=True,
+                )
+            except Exception as e:
+                # сбой тика не роняет процесс: опросим в следующий раз по расписанию
+                print({"action": "daemon_tick_failed", "error": str(e)[:300]})
+
+            for cab_index, state in due_keys:
+                next_due[(cab_index, state)] = time.monotonic() + _poll_interval_s(state)
+            print({"action": "daemon_tick_done", "polled": [f"{cabinets[ci][0].name}:{st}" for ci, st in due_keys], **stats})
+
+        sleep_s = min(next_due.values()) - time.monotonic()
+        # спим короткими шагами, чтобы быстро реагировать на SIGTERM
+        while not stopping["flag"] and sleep_s > 0:
+            time.sleep(min(sleep_s, 5.0))
+            sleep_s -= 5.0
+
+
+def _arg_value(flag: str) -> Optional[str]:
+    args = sys.argv[1:]
+    i = args.index(flag)
+    return args[i + 1] if i + 1 < len(args) and not args[i + 1].startswith("--") else None
 
 
 if __name__ == "__main__":
-    sync()
+    if "--daemon" in sys.argv[1:]:
+        daemon()
+    elif "--plan" in sys.argv[1:]:
+        plan(_arg_value("--plan"))
+    elif "--apply-plan" in sys.argv[1:]:
+        apply_plan_file(_arg_value("--apply-plan"))
+    else:
+        sync()
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import json
+import unittest
+from typing import Any, Iterator, List
+
+import app.http as http
+
+URL = "https://ms.example/api/entity/product"
+
+
+class _StreamResp:
+    def __init__(self, body: bytes, chunk: int) -> None:
+        self.status_code = 200
+        self.headers: dict = {}
+        self.body = body
+        self.chunk = chunk
+        self.closed = False
+
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+        for i in range(0, len(self.body), self.chunk):
+            yield self.body[i:i + self.chunk]
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class _Session:
+    def __init__(self, resp: _StreamResp) -> None:
+        self.resp = resp
+
+    def request(self, **kw: Any) -> _StreamResp:
+        return self.resp
+
+
+class IterJsonRowsTest(unittest.TestCase):
+    """Потоковый разбор rows на заглушке сессии: границы чанков, UTF-8, обрыв тела."""
+
+    def setUp(self) -> None:
+        http.configure_resilience()
+        self._saved_session = http._session
+
+    def tearDown(self) -> None:
+        http._session = self._saved_session
+
+    def _rows(self, body: bytes, chunk: int) -> List[Any]:
+        self.resp = _StreamResp(body, chunk)
+        http._session = _Session(self.resp)
+        return list(http.iter_json_rows("GET", URL, retries=1))
+
+    def test_rows_across_tiny_chunks(self) -> None:
+        rows = [{"id": str(i), "name": f"товар {i}", "n": [i, {"x": i}]} for i in range(5)]
+        body = json.dumps({"meta": {"size": 5}, "rows": rows}, ensure_ascii=False).encode("utf-8")
+        # чанки по 1..7 байт режут и ключ "rows", и многобайтные символы
+        for chunk in range(1, 8):
+            with self.subTest(chunk=chunk):
+                self.assertEqual(self._rows(body, chunk), rows)
+                self.assertTrue(self.resp.closed)
+
+    def test_rows_after_long_prefix(self) -> None:
+        rows = [{"id": "a"}]
+        body = json.dumps({"context": {"x": "y" * 200}, "rows": rows}).encode("utf-8")
+        self.assertEqual(self._rows(body, 3), rows)
+
+    def test_empty_rows(self) -> None:
+        self.assertEqual(self._rows(b'{"meta": {}, "rows" : [ ]}', 4), [])
+
+    def test_no_rows_key(self) -> None:
+        self.assertEqual(self._rows(b'{"meta": {"size": 0}}', 4), [])
+        self.assertTrue(self.resp.closed)
+
+    def test_truncated_between_rows(self) -> None:
+        with self.assertRaises(http.HttpError) as cm:
+            self._rows(b'{"rows": [{"id": "1"}, ', 5)
+        self.assertIn("Truncated", str(cm.exception))
+        self.assertTrue(self.resp.closed)
+
+    def test_truncated_inside_row(self) -> None:
+        with self.assertRaises(http.HttpError):
+            self._rows(b'{"rows": [{"id": "1"}, {"id": "2"', 5)
+        self.assertTrue(self.resp.closed)
+
+    def test_invalid_row(self) -> None:
+        with self.assertRaises(http.HttpError) as cm:
+            self._rows(b'{"rows": [{"id": oops}]}', 5)
+        self.assertIn("Invalid JSON rows", str(cm.exception))
+
+    def test_close_when_consumer_stops_early(self) -> None:
+        self.resp = _StreamResp(b'{"rows": [{"id": "1"}, {"id": "2"}]}', 4)
+        http._session = _Session(self.resp)
+        it = http.iter_json_rows("GET", URL, retries=1)
+        self.assertEqual(next(it), {"id": "1"})
+        it.close()
+        self.assertTrue(self.resp.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import threading
+import time
+import unittest
+from typing import List
+
+from app.rate_limit import FairRateBudget, current_tenant, tenant
+
+IDLE_S = 0.05
+
+
+class FairRateBudgetTest(unittest.TestCase):
+    def test_new_tenant_starts_at_active_minimum(self) -> None:
+        budget = FairRateBudget(rate_per_s=10_000, burst=100, idle_s=IDLE_S)
+        for _ in range(10):
+            budget.acquire("a")
+        budget.acquire("b")
+        # b не получает 10 токенов «долга» подряд
+        self.assertEqual(budget.stats(), {"a": 10, "b": 11})
+
+    def test_idle_tenant_is_caught_up(self) -> None:
+        budget = FairRateBudget(rate_per_s=10_000, burst=100, idle_s=IDLE_S)
+        for _ in range(20):
+            budget.acquire("a")
+        budget.acquire("b")
+        for _ in range(20):
+            budget.acquire("a")
+        time.sleep(IDLE_S * 2)
+        budget.acquire("a")
+        budget.acquire("b")  # простаивал, a активен — подтягивается до a
+        self.assertEqual(budget.stats(), {"a": 41, "b": 42})
+
+    def test_no_catch_up_when_everyone_idle(self) -> None:
+        budget = FairRateBudget(rate_per_s=10_000, burst=100, idle_s=IDLE_S)
+        for _ in range(20):
+            budget.acquire("a")
+        budget.acquire("b")
+        for _ in range(20):
+            budget.acquire("a")
+        time.sleep(IDLE_S * 2)
+        budget.acquire("b")
+        self.assertEqual(budget.stats(), {"a": 40, "b": 22})
+
+    def test_tenant_context(self) -> None:
+        budget = FairRateBudget(rate_per_s=10_000, burst=100, idle_s=IDLE_S)
+        with tenant("cab1"):
+            self.assertEqual(current_tenant.get(), "cab1")
+            budget.acquire()
+        self.assertEqual(current_tenant.get(), "")
+        self.assertEqual(budget.stats(), {"cab1": 1})
+
+    def test_noisy_tenant_does_not_starve_other(self) -> None:
+        # 200 ток/с на двоих: пока оба ждут, токены идут по очереди
+        budget = FairRateBudget(rate_per_s=200, burst=1, idle_s=IDLE_S)
+        order: List[str] = []
+        lock = threading.Lock()
+        start = threading.Barrier(2)
+
+        def worker(name: str, n: int) -> None:
+            start.wait()
+            for _ in range(n):
+                budget.acquire(name)
+                with lock:
+                    order.append(name)
+
+        threads = [threading.Thread(target=worker, args=("noisy", 40)), threading.Thread(target=worker, args=("quiet", 10))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(timeout=10)
+
+        self.assertEqual(order.count("noisy"), 40)
+        self.assertEqual(order.count("quiet"), 10)
+        last_quiet = max(i for i, n in enumerate(order) if n == "quiet")
+        # без честной очереди quiet ждал бы, пока noisy выберет свои 40
+        self.assertLess(last_quiet, 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
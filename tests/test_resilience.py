@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import time
+import unittest
+from typing import Any, List
+from unittest import mock
+
+import app.http as http
+from app.resilience import CircuitBreaker, RetryBudget
+
+# http.time — тот же модуль time: в SendTest sleep подменён, ждём cooldown настоящим
+_real_sleep = time.sleep
+
+
+class _Resp:
+    def __init__(self, status_code: int, body: bytes = b"{}") -> None:
+        self.status_code = status_code
+        self.content = body
+        self.text = body.decode("utf-8")
+        self.headers: dict = {}
+
+    def close(self) -> None:
+        pass
+
+
+class _Session:
+    """Заглушка requests.Session: отдаёт статусы (или бросает исключения) по очереди."""
+
+    def __init__(self, outcomes: List[Any]) -> None:
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def request(self, **kw: Any) -> _Resp:
+        self.calls += 1
+        out = self.outcomes.pop(0)
+        if isinstance(out, BaseException):
+            raise out
+        return _Resp(out)
+
+
+COOLDOWN_S = 0.05
+URL = "https://ms.example/api"
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_after_threshold_and_half_opens_after_cooldown(self) -> None:
+        b = CircuitBreaker("h", failure_threshold=2, cooldown_s=COOLDOWN_S)
+        b.record_failure()
+        self.assertTrue(b.allow())
+        b.record_failure()
+        self.assertTrue(b.is_open)
+        self.assertFalse(b.allow())
+
+        _real_sleep(COOLDOWN_S * 1.5)
+        self.assertTrue(b.allow())  # пробный запрос
+        self.assertEqual(b.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(b.allow())  # второй — пока проба в полёте
+
+    def test_probe_failure_reopens(self) -> None:
+        b = CircuitBreaker("h", failure_threshold=1, cooldown_s=COOLDOWN_S)
+        b.record_failure()
+        _real_sleep(COOLDOWN_S * 1.5)
+        self.assertTrue(b.allow())
+        b.record_failure()
+        self.assertTrue(b.is_open)
+
+    def test_neutral_on_probe_closes(self) -> None:
+        b = CircuitBreaker("h", failure_threshold=1, cooldown_s=COOLDOWN_S)
+        b.record_failure()
+        _real_sleep(COOLDOWN_S * 1.5)
+        self.assertTrue(b.allow())
+        b.record_neutral()
+        self.assertEqual(b.state, CircuitBreaker.CLOSED)
+        self.assertTrue(b.allow())
+
+    def test_neutral_does_not_count_as_failure(self) -> None:
+        b = CircuitBreaker("h", failure_threshold=1, cooldown_s=COOLDOWN_S)
+        for _ in range(5):
+            b.record_neutral()
+        self.assertEqual(b.state, CircuitBreaker.CLOSED)
+
+
+class RetryBudgetTest(unittest.TestCase):
+    def test_spend_and_deposit(self) -> None:
+        budget = RetryBudget(max_tokens=2, ratio=0.5)
+        self.assertTrue(budget.try_spend())
+        self.assertTrue(budget.try_spend())
+        self.assertFalse(budget.try_spend())
+        budget.deposit()
+        self.assertFalse(budget.try_spend())  # 0.5 токена — мало
+        budget.deposit()
+        self.assertTrue(budget.try_spend())
+
+    def test_deposit_is_capped(self) -> None:
+        budget = RetryBudget(max_tokens=1, ratio=1.0)
+        for _ in range(10):
+            budget.deposit()
+        self.assertEqual(budget.stats()["tokens"], 1.0)
+
+
+class SendTest(unittest.TestCase):
+    """Переходы предохранителя и бюджета в http._send на заглушке сессии (без сна и сети)."""
+
+    def setUp(self) -> None:
+        http.configure_resilience(failure_threshold=2, cooldown_s=COOLDOWN_S, retry_budget=50)
+        self._sleep = mock.patch.object(http.time, "sleep", lambda s: None)
+        self._sleep.start()
+        self._saved_session = http._session
+
+    def tearDown(self) -> None:
+        self._sleep.stop()
+        http._session = self._saved_session
+        http.configure_resilience()
+
+    def _use(self, outcomes: List[Any]) -> _Session:
+        s = _Session(outcomes)
+        http._session = s
+        return s
+
+    def test_success_after_retry(self) -> None:
+        s = self._use([502, 200])
+        self.assertEqual(http.request_json("GET", URL, retries=3), {})
+        self.assertEqual(s.calls, 2)
+        self.assertEqual(http.breaker_for(URL).state, CircuitBreaker.CLOSED)
+
+    def test_4xx_is_not_retried(self) -> None:
+        s = self._use([404])
+        with self.assertRaises(http.HttpError) as cm:
+            http.request_json("GET", URL, retries=3)
+        self.assertNotIsInstance(cm.exception, http.RetryableHttpError)
+        self.assertEqual(s.calls, 1)
+
+    def test_breaker_opens_without_sleeping_through_retries(self) -> None:
+        s = self._use([502, 502, 200])
+        with self.assertRaises(http.CircuitOpenError):
+            http.request_json("GET", URL, retries=5)
+        self.assertEqual(s.calls, 2)
+        # разомкнут — следующий запрос не отправляется
+        with self.assertRaises(http.CircuitOpenError):
+            http.request_json("GET", URL, retries=5)
+        self.assertEqual(s.calls, 2)
+
+    def test_429_on_half_open_probe_recovers(self) -> None:
+        # 502, 502 -> open; после cooldown проба получает 429 — цепь не должна залипнуть
+        s = self._use([502, 502, 429, 200, 200])
+        with self.assertRaises(http.CircuitOpenError):
+            http.request_json("GET", URL, retries=3)
+        _real_sleep(COOLDOWN_S * 1.5)
+        self.assertEqual(http.request_json("GET", URL, retries=3), {})
+        breaker = http.breaker_for(URL)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(http.request_json("GET", URL, retries=3), {})
+        self.assertEqual(s.calls, 5)
+
+    def test_429_does_not_open_breaker(self) -> None:
+        self._use([429, 429, 429, 200])
+        self.assertEqual(http.request_json("GET", URL, retries=4), {})
+        self.assertEqual(http.breaker_for(URL).state, CircuitBreaker.CLOSED)
+
+    def test_retry_budget_exhausted(self) -> None:
+        http.configure_resilience(failure_threshold=100, cooldown_s=COOLDOWN_S, retry_budget=1)
+        s = self._use([503, 503, 503, 200])
+        with self.assertRaises(http.RetryableHttpError) as cm:
+            http.request_json("GET", URL, retries=5)
+        self.assertIn("Retry budget exhausted", str(cm.exception))
+        self.assertEqual(s.calls, 2)
+
+    def test_non_idempotent_ambiguous_outcome(self) -> None:
+        s = self._use([502])
+        with self.assertRaises(http.AmbiguousWriteError):
+            http.request_json("POST", URL, json_body={}, retries=3, idempotent=False)
+        self.assertEqual(s.calls, 1)
+
+    def test_non_idempotent_read_timeout_is_ambiguous(self) -> None:
+        s = self._use([http.requests.exceptions.ReadTimeout("slow"), 200])
+        with self.assertRaises(http.AmbiguousWriteError):
+            http.request_json("POST", URL, json_body={}, retries=3, idempotent=False)
+        self.assertEqual(s.calls, 1)
+
+    def test_non_idempotent_connect_timeout_is_retried(self) -> None:
+        s = self._use([http.requests.exceptions.ConnectTimeout("no route"), 200])
+        self.assertEqual(http.request_json("POST", URL, json_body={}, retries=3, idempotent=False), {})
+        self.assertEqual(s.calls, 2)
+
+    def test_non_idempotent_rejected_is_retried(self) -> None:
+        s = self._use([503, 200])
+        self.assertEqual(http.request_json("POST", URL, json_body={}, retries=3, idempotent=False), {})
+        self.assertEqual(s.calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()